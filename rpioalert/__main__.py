@@ -1,81 +1,141 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-import json
+import functools
 import logging
+import math
+import os
+import resource
 import signal
 import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
 
-import adafruit_character_lcd.character_lcd_i2c as character_lcd_i2c
-import adafruit_character_lcd.character_lcd_rgb_i2c as character_lcd_rgb_i2c
+from .aiotemper import AsyncTemper
+from .condition import Condition, ConditionError
+from .config import ConfigError, Setup
+from .drivers import LCD_DRIVERS, RGB_LCD, backlight, led, loaded, open_lcd
+from .health import Health
+from .history import History
+from .metrics import Metrics, MetricsServer
+from .pins import PinGroup
+from .profiler import Profiler
+from .rpc import INVALID_PARAMS, RpcError, RpcServer
+from .scheduler import Scheduler
+from .snapshot import MAX_QUEUE_SIZE, Publisher, Snapshot
+from .store import Record, Store
+from .zone import Zone
 
-try:
-    import board
-except:
-    pass
 
-import busio
-from adafruit_character_lcd.character_lcd import _set_bit as set_bit
-from gpiozero import LED
-
-from .temper import Temper
+class Lcd:
+    """
+    Character LCD with a framebuffer of what is displayed
 
+    update_lcd only writes the cells that differ from the framebuffer, a
+    message identical to the displayed one costs no I2C traffic. backend
+    replaces the I2C LCD with any object offering the adafruit
+    character_lcd interface (cursor_position, message, clear, color).
+    """
 
-class Lcd:
-    def __init__(self, lcd_type=None, lcd_columns=16, lcd_rows=2):
+    def __init__(self, lcd_type=None, lcd_columns=16, lcd_rows=2, backend=None):
         self._lcd_type = lcd_type
-        self._lcd = None
+        self._lcd = backend
+        self._columns = lcd_columns
+        self._rows = lcd_rows
+        # Displayed rows, None when unknown (startup, after an error)
+        self._frame = None
+        self._color = None
         self._logger = logging.getLogger(self.__class__.__name__)
 
-        self._init_lcd(lcd_columns, lcd_rows)
+        if backend is None:
+            self._init_lcd(lcd_columns, lcd_rows)
 
     def _init_lcd(self, lcd_columns, lcd_rows):
         try:
             if self._lcd_type is None:
                 raise Exception("No LCD define")
 
-            i2c = busio.I2C(board.SCL, board.SDA)
-
-            if self._lcd_type == "sainsmart_charlcd_led":
-                self._lcd = character_lcd_rgb_i2c.Character_LCD_RGB_I2C(
-                    i2c, lcd_columns, lcd_rows)
-
-                self._lcd._mcp.iodira = set_bit(self._lcd._mcp.iodira, 5, 0)
-
-                # Turn on backlight
-                self._lcd._mcp.gpioa = set_bit(self._lcd._mcp.gpioa, 5, 0)
-
-            elif self._lcd_type == "adafruit_charlcd_mono":
-                self._lcd = character_lcd_i2c.Character_LCD_I2C(
-                    i2c, lcd_columns, lcd_rows)
-            elif self._lcd_type == "adafruit_charlcd_rgb":
-                self._lcd = character_lcd_rgb_i2c.Character_LCD_RGB_I2C(
-                    i2c, lcd_columns, lcd_rows)
+            self._lcd = open_lcd(self._lcd_type, lcd_columns, lcd_rows)
+            backlight(self._lcd, self._lcd_type, True)
         except:
             self._logger.debug(sys.exc_info())
 
+    def reopen(self, lcd_type):
+        """
+        Switch to another LCD type, None for none
+        """
+        self.clear_lcd()
+        self._lcd_type = lcd_type
+        self._lcd = None
+        self._frame = None
+        self._color = None
+        self._init_lcd(self._columns, self._rows)
+
     def update_led(self, red=0, green=0, blue=0):
-        if self._lcd is not None:
-            if self._lcd_type in ["adafruit_charlcd_rgb", "sainsmart_charlcd_led"]:
+        if self._lcd is not None and [red, green, blue] != self._color:
+            if self._lcd_type in RGB_LCD:
                 self._lcd.color = [red, green, blue]
+                self._color = [red, green, blue]
+
+    def _render(self, message):
+        """
+        return the message as rows padded/truncated to the display size
+        """
+        lines = message.split("\n")[:self._rows]
+        lines += [""] * (self._rows - len(lines))
+        return [line[:self._columns].ljust(self._columns) for line in lines]
+
+    def _changes(self, frame):
+        """
+        return [(column, row, text)] runs of cells that differ from the
+        displayed frame, runs one cell apart are merged as moving the cursor
+        costs as much as writing a cell
+        """
+        changes = []
+        for row, (old, new) in enumerate(zip(self._frame, frame)):
+            start = None
+            for column in range(self._columns + 1):
+                changed = column < self._columns and old[column] != new[column]
+                if changed and start is None:
+                    start = end = column
+                elif changed:
+                    end = column
+                elif start is not None and column - end > 1:
+                    changes.append((start, row, new[start:end + 1]))
+                    start = None
+            if start is not None:
+                changes.append((start, row, new[start:end + 1]))
+        return changes
 
     def update_lcd(self, message):
-        if self._lcd is not None:
-            try:
-                self._lcd.message = message
-            except:
-                self._logger.debug("Unable to set LCD message")
-                self._logger.debug(sys.exc_info())
+        if self._lcd is None:
+            return
+
+        frame = self._render(message)
+        if frame == self._frame:
+            return
+
+        try:
+            if self._frame is None:
+                self._lcd.cursor_position(0, 0)
+                self._lcd.message = "\n".join(frame)
+            else:
+                for column, row, text in self._changes(frame):
+                    self._lcd.cursor_position(column, row)
+                    self._lcd.message = text
+            self._frame = frame
+        except:
+            # The display content is unknown, redraw everything next time
+            self._frame = None
+            self._logger.debug("Unable to set LCD message")
+            self._logger.debug(sys.exc_info())
 
     def clear_lcd(self):
         if self._lcd is not None:
             try:
+                self._frame = None
                 self._lcd.clear()
-                if self._lcd_type == "sainsmart_charlcd_led":
-                    # Turn off backlight
-                    self._lcd._mcp.gpioa = set_bit(self._lcd._mcp.gpioa, 5, 1)
+                backlight(self._lcd, self._lcd_type, False)
             except:
                 self._logger.debug("Unable to clear LCD")
                 self._logger.debug(sys.exc_info())
@@ -105,273 +165,437 @@ class Status:
     def humidity(self, hum):
         self._humidity = hum
 
-    def update_lcd(self):
-        message = "T: {:.2f}C  {}\nH: {:.2f}%".format(
+    def message(self):
+        if self._temperature is None or self._humidity is None:
+            return "T: --  {}\nH: --".format(time.strftime("%H:%M"))
+        return "T: {:.2f}C  {}\nH: {:.2f}%".format(
             self._temperature, time.strftime("%H:%M"), self._humidity)
-        self.lcd.update_lcd(message)
+
+    def update_lcd(self):
+        self.lcd.update_lcd(self.message())
 
     def dict(self):
         return {"temperature": self._temperature, "humidity": self._humidity}
 
 
-def get_status(temper):
+class LcdWorker:
+    """
+    Writes messages to the Lcd on its own executor thread
+
+    submit() never waits, while a write is running only the latest message
+    submitted is kept and written after it, so a slow I2C bus delays the
+    display, never the sensor polling.
+    """
+
+    def __init__(self, lcd, executor=None, loop=None, profiler=None):
+        self.lcd = lcd
+        self._executor = executor or ThreadPoolExecutor(max_workers=1)
+        self._loop = loop or asyncio.get_event_loop()
+        self._profiler = profiler
+        self._pending = None
+        self._running = None
+        self._start_time = None
+
+    def submit(self, message):
+        self._pending = message
+        if self._running is None:
+            self._start()
+
+    def _start(self):
+        message, self._pending = self._pending, None
+        self._start_time = time.perf_counter()
+        self._running = self._loop.run_in_executor(
+            self._executor, self.lcd.update_lcd, message)
+        self._running.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._running = None
+        if self._profiler is not None:
+            self._profiler.observe("lcd", time.perf_counter() - self._start_time)
+        if self._pending is not None:
+            self._start()
+
+
+async def get_status(temper, profiler=None):
+    """
+    return the Reading of every device, empty on error
+    """
     logger = logging.getLogger("rpioalert.get_status")
+    profiler = profiler or Profiler()
     status = []
     try:
-        raw_status = temper.read()
+        with profiler.stage("read"):
+            status = await temper.read()
 
-        if not len(raw_status):
+        if not len(status):
             raise Exception("No status")
-
-        for stat in raw_status:
-            temper_stat = {}
-            for key, value in stat.items():
-                key = key.replace(" ", "_").lower()
-
-                try:
-                    value = (None if value == "" else str(value))
-                except:
-                    pass
-
-                temper_stat[key] = value
-            status.append(temper_stat)
+    except asyncio.CancelledError:
+        raise
     except:
         logger.debug(sys.exc_info())
 
     return status
 
 
-def compare(comparison, value_to_compare, current_value):
-    try:
-        if comparison == "eq":
-            return float(current_value) == float(value_to_compare)
-        elif comparison == "gt":
-            return float(current_value) > float(value_to_compare)
-        elif comparison == "gte":
-            return float(current_value) >= float(value_to_compare)
-        elif comparison == "lt":
-            return float(current_value) < float(value_to_compare)
-        elif comparison == "lte":
-            return float(current_value) <= float(value_to_compare)
-        else:
-            return False
-    except:
-        return False
-
-
-def logic_gate(logic, value_left, value_right):
-    if logic == "or":
-        result = (value_left or value_right)
-    elif logic == "xor":
-        result = (bool(value_left) != bool(value_right))
-    elif logic == "nand":
-        result = not (value_left and value_right)
-    elif logic == "nor":
-        result = not (value_left or value_right)
-    elif logic == "xnor":
-        result = not (bool(value_left) != bool(value_right))
-    else:
-        # Default AND
-        result = (value_left and value_right)
-
-    return result
-
-
-def format_condition(condition, as_str=False):
-    condition_configs = []
-    for c in condition:
-        condition_config = c.split(":")
-        if len(condition_config) == 3:
-            # Added defult logic gate
-            condition_config.append("and")
-            condition_configs.append(condition_config)
-        elif len(condition_config) == 4:
-            condition_configs.append(condition_config)
-        else:
-            # Remove invalid condition format
-            continue
-
-    if as_str is False:
-        return condition_configs
-
-    condition_str = []
-    for i, c in enumerate(condition_configs):
-        value_type, comparison, value_to_compare, logic = c
-        if i > 0:
-            condition_str.append(logic)
-        condition_str.append("{}:{}:{}".format(
-            value_type, comparison, value_to_compare))
-
-    if not len(condition_str):
-        return "None"
-
-    return " ".join(condition_str)
-
-
-def toggle_led(leds, condition, avg_temp, avg_humid, turn_on):
+def toggle_led(pins, condition, avg_temp, avg_humid, turn_on):
     """
-    Toggle led if condition is Reach
+    Set desired pin state if condition is Reach, pins.apply() writes it
     return bool(reach)
     """
     logger = logging.getLogger("rpioalert.toggle_led")
-    reach = None
-
-    condition_configs = format_condition(condition)
-    condition_str = format_condition(condition, True)
-
-    for c in condition_configs:
-        value_type, comparison, value_to_compare, logic = c
-
-        if value_type in ["t", "temp", "temperature"]:
-            current_value = avg_temp
-        elif value_type in ["h", "hum", "humidity"]:
-            current_value = avg_humid
-        else:
-            continue
 
-        compare_result = compare(comparison, value_to_compare, current_value)
-        if reach is None:
-            reach = compare_result
-            continue
-
-        reach = logic_gate(logic, reach, compare_result)
+    reach = condition(avg_temp, avg_humid)
 
     logger.debug("{} : {}, T:{}, H:{}, Reach:{}".format(
-        "ON" if turn_on else "OFF", condition_str, avg_temp, avg_humid, reach))
+        "ON" if turn_on else "OFF", condition, avg_temp, avg_humid, reach))
 
     # Not reach
     if reach is False:
         return False
 
-    for led in leds:
-        if turn_on is True and led.is_lit is False:
-            logger.debug("{}, T:{}, H:{}, LED:{}, OFF->ON".format(
-                condition_str, avg_temp, avg_humid, led.pin.number))
-            led.on()
-        elif turn_on is False and led.is_lit is True:
-            logger.debug("{}, T:{}, H:{}, LED:{}, ON->OFF".format(
-                condition_str, avg_temp, avg_humid, led.pin.number))
-            led.off()
-
-    current_state = ["LED:{} {}".format(
-        l.pin.number, "ON" if l.is_lit else "OFF") for l in leds]
-    logger.debug("Current state {}".format(", ".join(current_state)))
+    pins.set(turn_on)
 
     # Reach
     return True
 
 
-async def rpc_server(leds, stats, listen="0.0.0.0", port=15555, off_condition=[], on_condition=[], off_first=False, lock=None, executor=None, loop=None):
+def rpc_params(params):
+    """
+    return the params of a request taking named params, raise RpcError
+    """
+    if not isinstance(params, dict):
+        raise RpcError(INVALID_PARAMS, "Params must be an object")
+    return params
+
+
+def rpc_number(params, name, default=None, minimum=None, integer=False):
+    """
+    return params[name], default when missing or null, checked as a finite number,
+    an integer when integer, of at least minimum, raise RpcError
+    """
+    value = params.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int if integer else (int, float)) or \
+            not math.isfinite(value) or minimum is not None and value < minimum:
+        raise RpcError(INVALID_PARAMS, "Invalid {} '{}'".format(name, value))
+    return value
+
+
+async def rpc_server(publisher, listen="0.0.0.0", port=15555, executor=None, loop=None, history=None, store=None, max_connections=16, profiler=None, setup=None, store_executor=None):
+    """
+    store_executor, the single thread running every call to store, is
+    shared with rpio_alert
+    """
     executor = executor or ThreadPoolExecutor(max_workers=1)
+    store_executor = store_executor or ThreadPoolExecutor(max_workers=1)
     loop = loop or asyncio.get_event_loop()
     logger = logging.getLogger("rpioalert.rpc_server")
 
-    async def rpc_handler(reader, writer):
-        request = await reader.read(1024)
-        request = json.loads(request.decode())
+    async def get_status(params):
+        # Published by rpio_alert once per tick, already JSON encoded
+        return publisher.snapshot
+
+    async def subscribe(params):
+        params = rpc_params(params)
+        queue_size = params.get("queue_size", 16)
+        if not isinstance(queue_size, int) or isinstance(queue_size, bool) or \
+                not 1 <= queue_size <= MAX_QUEUE_SIZE:
+            raise RpcError(INVALID_PARAMS, "queue_size must be an integer from 1 to {}".format(MAX_QUEUE_SIZE))
+        return publisher.subscribe(**{
+            "temperature_deadband": float(rpc_number(params, "temperature_deadband", 0.1, minimum=0)),
+            "humidity_deadband": float(rpc_number(params, "humidity_deadband", 0.5, minimum=0)),
+            "queue_size": queue_size
+        })
+
+    async def get_zone(params):
+        for zone in publisher.snapshot.data.get("zones", []):
+            if zone["name"] == params.get("name"):
+                return {"zone": zone, "time": publisher.snapshot.data["time"]}
+        raise RpcError(INVALID_PARAMS, "Unknown zone")
+
+    async def get_history(params):
+        params = rpc_params(params)
+        return {
+            "history": [] if history is None else history.dict(**{
+                "metric": params.get("metric"),
+                "device": params.get("device"),
+                "since": rpc_number(params, "since"),
+                "limit": rpc_number(params, "limit", minimum=0, integer=True)
+            }),
+            "time": str(int(time.time()))
+        }
+
+    async def get_records(params):
+        params = rpc_params(params)
+        # On the store thread, in turn with the writes and compaction
+        records = [] if store is None else await loop.run_in_executor(
+            store_executor, functools.partial(store.query, **{
+                "since": rpc_number(params, "since"),
+                "until": rpc_number(params, "until"),
+                "device": params.get("device"),
+                "limit": rpc_number(params, "limit", minimum=0, integer=True)
+            }))
+        return {
+            "records": [r.dict() for r in records],
+            "time": str(int(time.time()))
+        }
+
+    async def get_stats(params):
+        return {
+            "stats": {} if profiler is None else profiler.dict(),
+            "time": str(int(time.time()))
+        }
+
+    async def reload(params):
+        if setup is None:
+            raise RpcError(INVALID_PARAMS, "Reload not available")
+        try:
+            return await setup.reload()
+        except (ConfigError, ConditionError) as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+
+    server = RpcServer(max_connections=max_connections, profiler=profiler)
+    server.register("get_status", get_status)
+    server.register("subscribe", subscribe)
+    server.register("get_zone", get_zone)
+    server.register("get_history", get_history)
+    server.register("get_records", get_records)
+    server.register("get_stats", get_stats)
+    server.register("reload", reload)
 
-        logger.debug("Request : {}".format(request))
+    try:
+        logger.info("Start rpc server, listening on {}:{}".format(listen, port))
+        await server.start(listen, port)
+    except:
+        logger.info(sys.exc_info())
 
-        response = None
 
-        try:
-            if request["method"] == "get_status":
-                async with lock:
-                    led_state = [{"pin": l.pin.number, "state": l.is_lit}
-                                 for l in leds]
-                    current_state = {
-                        "status": stats.dict(),
-                        "condition": {
-                            "off": off_condition,
-                            "on": on_condition,
-                            "off_first": off_first
-                        },
-                        "led": led_state,
-                        "time": str(int(time.time()))
-                    }
-                    response = json.dumps(current_state)
-
-            logger.debug("Response : {}".format(response))
-
-            writer.write(response.encode())
-            await writer.drain()
-            writer.close()
-        except:
-            logger.debug(sys.exc_info())
-            writer.close()
+async def metrics_server(metrics, listen="0.0.0.0", port=9105):
+    logger = logging.getLogger("rpioalert.metrics_server")
 
     try:
-        logger.info("Start rpc server, listening on {}:{}".format(listen, port))
-        server = asyncio.start_server(rpc_handler, listen, port)
-        await server
+        logger.info("Start metrics server, listening on {}:{}".format(listen, port))
+        await MetricsServer(metrics).start(listen, port)
     except:
         logger.info(sys.exc_info())
 
 
-async def rpio_alert(leds, stats, off_condition=[], on_condition=[], off_first=False, lock=None, executor=None, both=False, loop=None):
+async def rpio_alert(pins, stats, off_condition=Condition(), on_condition=Condition(), off_first=False, lock=None, executor=None, both=False, loop=None, read_timeout=2.0, history=None, store=None, publisher=None, metrics=None, scheduler=None, profiler=None, temper=None, zones=None, default=None, broker=None, store_executor=None):
+    """
+    Read every device once per tick, drive the pins of each zone
+
+    Without zones, pins, off_condition, on_condition and off_first form a
+    single zone of every device, or default when given. zones and default
+    are read on every tick, a reload may change them in place. broker, a
+    shm.Broker, gets the readings and pin states of every tick. store is
+    only used on store_executor, a single thread shared with rpc_server.
+    """
     executor = executor or ThreadPoolExecutor(max_workers=1)
+    store_executor = store_executor or ThreadPoolExecutor(max_workers=1)
     loop = loop or asyncio.get_event_loop()
     logger = logging.getLogger("rpioalert.rpio_alert")
 
-    temper = Temper()
+    scheduler = scheduler or Scheduler()
+    profiler = profiler or Profiler()
+    lcd_worker = LcdWorker(stats.lcd, executor, loop, profiler)
+
+    temper = temper or AsyncTemper(device_timeout=read_timeout, loop=loop)
+    health = getattr(temper, "health", None)
     stop = False
 
-    while not stop:
+    def write(records):
+        # On the store thread, the tick does not wait for it
+        start = time.perf_counter()
         try:
-            temper_status = await loop.run_in_executor(executor, get_status, temper)
+            store.append(records)
+            if store.pending:
+                store.compact()
+        except:
+            logger.debug(sys.exc_info())
+        loop.call_soon_threadsafe(profiler.observe, "store", time.perf_counter() - start)
 
-            if len(temper_status) == 0:
-                raise Exception("Empty status")
+    if default is None:
+        default = Zone("default", pins, off_condition, on_condition, off_first)
+    if zones is None:
+        zones = []
 
-            temps = []
-            humis = []
+    try:
+        scheduler.start()
+        while not stop:
+            tick_start = time.monotonic()
+            tick_error = True
+            avg_temp = avg_humid = None
+            try:
+                temper_status = await get_status(temper, profiler)
+                for r in temper_status:
+                    if r.device in temper.read_times:
+                        profiler.observe_device(
+                            r.device, temper.read_times[r.device], r.error is not None)
+                if metrics is not None:
+                    metrics.observe_read(time.monotonic() - tick_start, temper_status)
+
+                temps = [r.internal_temperature for r in temper_status
+                         if r.internal_temperature is not None]
+                humis = [r.internal_humidity for r in temper_status
+                         if r.internal_humidity is not None]
+
+                # Without a record the pins are left as they are, the device
+                # health is still published below
+                if temps and humis:
+                    avg_temp = sum(temps) / len(temps)
+                    avg_humid = sum(humis) / len(humis)
+
+                if history is not None and avg_temp is not None:
+                    history_start = time.perf_counter()
+                    now = time.time()
+                    history.add(now, "temperature", avg_temp)
+                    history.add(now, "humidity", avg_humid)
+                    for r in temper_status:
+                        # A stale reading is a repeat, not a new value
+                        if r.stale:
+                            continue
+                        if r.internal_temperature is not None:
+                            history.add(now, "temperature", r.internal_temperature, r.device)
+                        if r.internal_humidity is not None:
+                            history.add(now, "humidity", r.internal_humidity, r.device)
+                    profiler.observe("history", time.perf_counter() - history_start)
+
+                lock_start = time.perf_counter()
+                async with lock:
+                    profiler.observe("lock_wait", time.perf_counter() - lock_start)
+                    stats.temperature = avg_temp
+                    stats.humidity = avg_humid
+                    lcd_worker.submit(stats.message())
+
+                    active = zones or [default]
+                    pins = PinGroup([zone.pins for zone in zones]) if zones else default.pins
+
+                    with profiler.stage("toggle"):
+                        for zone in active:
+                            if not zone.update(temper_status):
+                                logger.debug("No record for zone {}".format(zone.name))
+                                continue
+
+                            if zone.off_first:
+                                condition = [zone.off_condition, zone.on_condition]
+                                turn_on = [False, True]
+                            else:
+                                condition = [zone.on_condition, zone.off_condition]
+                                turn_on = [True, False]
+
+                            reach = toggle_led(zone.pins, condition[0], zone.temperature,
+                                               zone.humidity, turn_on=turn_on[0])
+                            if not reach:
+                                toggle_led(zone.pins, condition[1], zone.temperature,
+                                           zone.humidity, turn_on=turn_on[1])
+
+                            for pin, state in zone.pins.apply():
+                                logger.debug("{} T:{}, H:{}, LED:{}, {}".format(
+                                    zone.name, zone.temperature, zone.humidity, pin,
+                                    "OFF->ON" if state else "ON->OFF"))
+                        logger.debug("Current state {}".format(pins))
+
+                    if publisher is not None:
+                        with profiler.stage("publish"):
+                            publisher.publish(Snapshot(
+                                stats, pins, default.off_condition, default.on_condition,
+                                default.off_first, zones or None,
+                                None if health is None else health.dict()))
+
+                    if broker is not None:
+                        with profiler.stage("broker"):
+                            broker.publish(temper_status, pins.state(), (avg_temp, avg_humid))
+
+                if store is not None and avg_temp is not None:
+                    now = time.time()
+                    bitmap = pins.bitmap()
+                    records = [Record(now, "", avg_temp, avg_humid, bitmap)]
+                    for r in temper_status:
+                        if r.stale:
+                            continue
+                        records.append(Record(now, r.device, r.internal_temperature,
+                                              r.internal_humidity, bitmap))
+                    loop.run_in_executor(store_executor, write, records)
+
+                if avg_temp is None:
+                    raise Exception("Empty status" if not temper_status else "No record from temper device")
+
+                scheduler.adapt(avg_temp, avg_humid, min([
+                    scheduler.distance(zone.temperature, zone.humidity, zone.thresholds())
+                    for zone in active if zone.temperature is not None], default=None))
+                tick_error = False
+            except asyncio.CancelledError:
+                stop = True
+            except KeyboardInterrupt:
+                stop = True
+            except:
+                logger.debug(sys.exc_info())
 
-            for s in temper_status:
-                if "internal_temperature" in s:
-                    temps.append(s["internal_temperature"] or 0)
+            if not stop:
+                profiler.observe("tick", time.monotonic() - tick_start)
 
-                if "internal_humidity" in s:
-                    humis.append(s["internal_humidity"] or 0)
+            if metrics is not None and not stop:
+                if tick_error:
+                    metrics.observe_tick(time.monotonic() - tick_start, (avg_temp, avg_humid), error=True)
+                else:
+                    metrics.observe_tick(time.monotonic() - tick_start, (avg_temp, avg_humid),
+                                         pins, zones=zones or None)
+                metrics.observe_scheduler(scheduler)
+                metrics.render()
 
-            if len(temps) == 0 or len(humis) == 0:
-                raise Exception("No record from temper device")
+            await scheduler.sleep()
+    finally:
+        temper.close()
+        if store is not None:
+            # After the writes still queued
+            await loop.run_in_executor(store_executor, store.close)
 
-            avg_temp = sum(map(float, temps)) / len(temps)
-            avg_humid = sum(map(float, humis)) / len(humis)
 
-            async with lock:
-                stats.temperature = avg_temp
-                stats.humidity = avg_humid
-                await loop.run_in_executor(executor, stats.update_lcd)
+async def shutdown(task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
 
-                if off_first:
-                    condition = [off_condition, on_condition]
-                    turn_on = [False, True]
-                else:
-                    condition = [on_condition, off_condition]
-                    turn_on = [True, False]
-
-                reach = toggle_led(leds, condition[0], avg_temp,
-                                   avg_humid, turn_on=turn_on[0])
-                if not reach:
-                    toggle_led(leds, condition[1], avg_temp,
-                               avg_humid, turn_on=turn_on[1])
-        except asyncio.CancelledError:
-            stop = True
-        except KeyboardInterrupt:
-            stop = True
-        except:
-            logger.debug(sys.exc_info())
 
-        await asyncio.sleep(1)
+def process_age():
+    """
+    return seconds since the process started, including the interpreter
+    start and the imports, None when /proc is not available
+    """
+    try:
+        with open("/proc/self/stat") as fp:
+            # Fields after the command name, which may contain spaces
+            fields = fp.read().rpartition(")")[2].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except:
+        return None
 
 
-async def shutdown(task):
-    task.cancel()
-    await task
+def startup_report(startup):
+    """
+    return the startup phases [(name, seconds)] as a text table, with the
+    driver libraries loaded and the peak memory
+    """
+    lines = ["{:<12}{:>10.1f}".format(name, seconds * 1000) for name, seconds in startup]
+    lines.append("drivers     {}".format(", ".join(loaded()) or "none"))
+    lines.append("max rss     {} kB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    return "\n".join(lines)
 
 
 def main():
+    if sys.argv[1:2] == ["aggregate"]:
+        from .aggregate import main as aggregate
+        sys.exit(aggregate(sys.argv[2:]))
+
+    started = time.perf_counter()
+    # Interpreter start and imports, until main
+    age = process_age()
+    startup = [] if age is None else [("imports", age)]
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-rpc", help="Start rpc server",
                         action="store_true", default=False)
@@ -381,75 +605,230 @@ def main():
                         action="store_true", default=False)
     parser.add_argument(
         "-off_first", help="Check OFF condition first, then ON condition", action="store_true", default=False)
-    parser.add_argument("--lcd", help="Use I2C LCD 16x2 to show status", choices=[
-                        "sainsmart_charlcd_led", "adafruit_charlcd_rgb", "adafruit_charlcd_mono"], default=None)
+    parser.add_argument("--lcd", help="Use I2C LCD 16x2 to show status", choices=list(LCD_DRIVERS), default=None)
     parser.add_argument("--pin", help="GPIO Pin", type=int,
                         action='append', default=[])
     parser.add_argument(
         "--off", help="Pin Off condition, format: <temp|hum>:<eq|lt|lte|gt|gte>:<value>:[or|and|xor|nand|nor|xnor]", action="append", default=[])
     parser.add_argument(
         "--on", help="Pin On condition, format: <temp|hum>:<eq|lt|lte|gt|gte>:<value>:[or|and|xor|nand|nor|xnor]", action="append", default=[])
+    parser.add_argument(
+        "--zone", help="Zone of sensors with its own pins and conditions, JSON: {\"name\": \"rack1\", \"sensors\": [\"001/004\"], \"pins\": [17], \"on\": [...], \"off\": [...], \"off_first\": false}, can be repeated",
+        action="append", default=[])
     parser.add_argument(
         "--rpc_listen", help="Listen address, default all 0.0.0.0", type=str, default="0.0.0.0")
     parser.add_argument(
         "--rpc_port", help="Listen port, default 15555", type=int, default=15555)
+    parser.add_argument(
+        "--rpc_max_connections", help="Maximum concurrent rpc connections, default 16", type=int, default=16)
+    parser.add_argument(
+        "--history_size", help="Number of readings kept per metric and device for get_history, default 3600, 0 to disable", type=int, default=3600)
+    parser.add_argument(
+        "--store", help="Directory to keep a persistent log of readings, default disabled", type=str, default=None)
+    parser.add_argument(
+        "--store_flush", help="Seconds between writes of the reading log to disk, default 60", type=int, default=60)
+    parser.add_argument(
+        "--read_timeout", help="Per device read timeout in seconds, default 2", type=float, default=2.0)
+    parser.add_argument(
+        "--device_failures", help="Consecutive failed reads before a device is only probed on a backoff schedule, default 3", type=int, default=3)
+    parser.add_argument(
+        "--device_backoff", help="Seconds before probing a failing device, doubled after each failed probe, default 5", type=float, default=5.0)
+    parser.add_argument(
+        "--device_max_backoff", help="Maximum seconds between probes of a failing device, default 300", type=float, default=300.0)
+    parser.add_argument(
+        "--stale_ttl", help="Seconds the last good reading of a failing device is reused, default 60, 0 to exclude it at once", type=float, default=60.0)
+    parser.add_argument(
+        "--interval", help="Seconds between readings, default 1", type=float, default=1.0)
+    parser.add_argument(
+        "--min_interval", help="Poll as fast as this when a reading is within --adaptive_margin of a condition, default --interval", type=float, default=None)
+    parser.add_argument(
+        "--max_interval", help="Slow down up to this while readings are stable and far from any condition, default --interval", type=float, default=None)
+    parser.add_argument(
+        "--adaptive_margin", help="Distance to a condition value, and change between readings, considered significant, default 1", type=float, default=1.0)
+    parser.add_argument(
+        "--profile", help="Log a summary of the time spent in each stage on stop",
+        action="store_true", default=False)
+    parser.add_argument(
+        "--startup_time", help="Log the time spent in each startup phase and the drivers loaded, then exit without polling",
+        action="store_true", default=False)
+    parser.add_argument(
+        "--metrics_listen", help="Metrics listen address, default all 0.0.0.0", type=str, default="0.0.0.0")
+    parser.add_argument(
+        "--metrics_port", help="Serve OpenMetrics/Prometheus metrics over HTTP on this port, default disabled", type=int, default=None)
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--shm", help="Publish the readings and pin states in this shared memory segment for local readers, e.g. temper.py --from-daemon, default rpioalert when given without a name",
+        nargs="?", const="rpioalert", default=None)
+    parser.add_argument(
+        "--config", help="JSON file of settings named as the options, e.g. {\"pin\": [17], \"on\": [\"temp:gte:30\"]}, reloaded on SIGHUP", type=str, default=None)
+
+    setup = Setup(parser)
+    config_error = None
+    try:
+        args = setup.parse()
+        # -stop only needs the pins, a typo in a condition must not leave them on
+        if not args.stop:
+            setup.check(args)
+    except ConfigError as e:
+        args = parser.parse_args()
+        if not args.stop:
+            parser.error(str(e))
+        config_error = e
+    except ConditionError as e:
+        parser.error(str(e))
 
     logging.basicConfig(
         level=logging.DEBUG if args.verbose else logging.INFO,
         format="%(asctime)s %(levelname)-8s %(name)-30s %(message)s"
     )
     logger = logging.getLogger("rpioalert.main")
+    mark = time.perf_counter()
+    startup.append(("arguments", mark - started))
 
     if args.stop is True:
+        if config_error is not None:
+            logger.warning("Only resetting the command line pins: {}".format(config_error))
         logger.info("Reset LED")
-        for pin in args.pin:
-            led = LED(pin)
-            led.off()
-            led.close()
+        for pin in setup.pins(args):
+            try:
+                output = led(pin)
+                output.off()
+                output.close()
+            except:
+                logger.info("Unable to reset GPIO Pin {}".format(pin))
+                logger.debug(sys.exc_info())
+        startup.append(("pins", time.perf_counter() - mark))
+        startup.append(("total", time.perf_counter() - started + (age or 0)))
+        if args.startup_time:
+            logger.info("Startup (ms)\n{}".format(startup_report(startup)))
         sys.exit()
 
-    try:
-        leds = [LED(pin) for pin in args.pin]
-    except:
-        logger.info("Unable to connect to GPIO Pin {}".format(args.pin))
-        logger.debug(sys.exc_info())
-
     loop = asyncio.get_event_loop()
-    executor = ThreadPoolExecutor(max_workers=1)
+    # Only used to write the LCD, sensors are read on the event loop
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lcd")
+    lock = asyncio.Lock()
+    scheduler = Scheduler()
+
+    setup.lock = lock
+    setup.executor = executor
+    setup.loop = loop
+    setup.scheduler = scheduler
+    setup.temper = AsyncTemper(device_timeout=args.read_timeout, loop=loop, health=Health())
+    setup.apply(args)
+
+    now = time.perf_counter()
+    startup.append(("pins", now - mark))
+    mark = now
 
     lcd = Lcd(lcd_type=args.lcd)
     stats = Status(lcd=lcd)
+    setup.lcd = lcd
+
+    now = time.perf_counter()
+    startup.append(("lcd", now - mark))
+    mark = now
+
+    zones = setup.zones
+    default = setup.default
+    publisher = Publisher(Snapshot(**{
+        "stats": stats,
+        "pins": PinGroup([zone.pins for zone in zones]) if zones else default.pins,
+        "off_condition": default.off_condition,
+        "on_condition": default.on_condition,
+        "off_first": default.off_first,
+        "zones": zones or None
+    }))
+    broker = None
+    if args.shm:
+        from .shm import Broker, ShmError
+        try:
+            broker = Broker(args.shm)
+        except ShmError as e:
+            executor.shutdown()
+            parser.error(str(e))
+        except (OSError, ValueError):
+            logger.info("Unable to create shared memory {}".format(args.shm))
+            logger.debug(sys.exc_info())
 
-    lock = asyncio.Lock()
+    history = History(args.history_size) if args.history_size > 0 else None
+    store = Store(args.store, flush_interval=args.store_flush) if args.store else None
+    # The store has its own thread, a rollup must not hold up the LCD
+    store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+    metrics = Metrics() if args.metrics_port else None
+    profiler = Profiler()
+
+    now = time.perf_counter()
+    startup.append(("setup", now - mark))
+    startup.append(("total", now - started + (age or 0)))
+    for name, seconds in startup:
+        profiler.observe("startup." + name, seconds)
+
+    if args.startup_time:
+        logger.info("Startup (ms)\n{}".format(startup_report(startup)))
+        executor.shutdown(wait=True)
+        store_executor.shutdown(wait=True)
+        loop.close()
+        lcd.clear_lcd()
+        setup.close()
+        if broker is not None:
+            broker.close()
+        return
 
     tasks = [
         asyncio.ensure_future(rpio_alert(**{
-            "leds": leds,
-            "off_condition": args.off,
-            "on_condition": args.on,
-            "off_first": args.off_first,
+            "pins": default.pins,
             "stats": stats,
             "lock": lock,
             "executor": executor,
-            "loop": loop
+            "loop": loop,
+            "read_timeout": args.read_timeout,
+            "history": history,
+            "store": store,
+            "publisher": publisher,
+            "metrics": metrics,
+            "scheduler": scheduler,
+            "profiler": profiler,
+            "temper": setup.temper,
+            "zones": zones,
+            "default": default,
+            "broker": broker,
+            "store_executor": store_executor
         }))
     ]
 
+    async def reload():
+        try:
+            await setup.reload()
+        except (ConfigError, ConditionError) as e:
+            logger.info("Reload failed, keeping the running settings: {}".format(e))
+
+    loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reload()))
+    # Stop as on Ctrl-C, so the pins are turned off
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
     if args.rpc:
         tasks.append(
             asyncio.ensure_future(rpc_server(**{
-                "leds": leds,
+                "publisher": publisher,
                 "listen": args.rpc_listen,
                 "port": args.rpc_port,
-                "off_condition": args.off,
-                "on_condition": args.on,
-                "off_first": args.off_first,
-                "stats": stats,
-                "lock": lock,
                 "executor": executor,
-                "loop": loop
+                "loop": loop,
+                "history": history,
+                "store": store,
+                "max_connections": args.rpc_max_connections,
+                "profiler": profiler,
+                "setup": setup,
+                "store_executor": store_executor
+            }))
+        )
+
+    if metrics is not None:
+        tasks.append(
+            asyncio.ensure_future(metrics_server(**{
+                "metrics": metrics,
+                "listen": args.metrics_listen,
+                "port": args.metrics_port
             }))
         )
 
@@ -464,16 +843,21 @@ def main():
         logger.debug(sys.exc_info())
 
     logger.info("Stop rpioalert")
-    loop.run_until_complete(asyncio.wait([shutdown(t) for t in tasks]))
-    executor.shutdown(wait=True)
-    loop.close()
-
-    lcd.clear_lcd()
-
-    for led in leds:
-        if not led.closed:
-            led.off()
-            led.close()
+    try:
+        loop.run_until_complete(asyncio.gather(
+            *[shutdown(t) for t in tasks], return_exceptions=True))
+    finally:
+        executor.shutdown(wait=True)
+        store_executor.shutdown(wait=True)
+        loop.close()
+
+        lcd.clear_lcd()
+        setup.close()
+        if broker is not None:
+            broker.close()
+
+    if args.profile:
+        logger.info("Timings (ms)\n{}".format(profiler.summary()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import sys
+import time
+
+from .rpc import INVALID_PARAMS, RawJSON, RpcError, RpcServer
+from .scheduler import Scheduler
+
+
+def parse_node(text, default_port=15555):
+    """
+    return (host, port) of "host", "host:port" or "[ipv6]:port"
+    """
+    host, port = text, default_port
+    if text.startswith("["):
+        host, _, rest = text[1:].partition("]")
+        if rest.startswith(":"):
+            port = rest[1:]
+    elif text.count(":") == 1:
+        host, port = text.split(":")
+
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError("Invalid node '{}'".format(text))
+    if not host or not 0 < port < 65536:
+        raise ValueError("Invalid node '{}'".format(text))
+    return host, port
+
+
+class Node:
+    """
+    One rpioalert node, polled over a persistent JSON-RPC 2.0 connection
+
+    The connection is opened on first use and kept for the following polls.
+    A failed or timed out poll closes it, the node is then left alone for
+    backoff seconds, doubled after every failure up to max_backoff. The last
+    good status is kept with the time it was received.
+    """
+
+    def __init__(self, host, port=15555, timeout=2.0, backoff=1.0, max_backoff=60.0):
+        self.host = host
+        self.port = port
+        self.name = ("[{}]:{}" if ":" in host else "{}:{}").format(host, port)
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.status = None
+        self.updated = None
+        self.error = None
+        self.failures = 0
+        self._retry_at = 0.0
+        self._reader = None
+        self._writer = None
+        self._id = 0
+        self._logger = logging.getLogger("{}.{}".format(self.__class__.__name__, self.name))
+
+    async def call(self, method, params=None):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+        self._id += 1
+        request = {"jsonrpc": "2.0", "method": method, "id": self._id}
+        if params is not None:
+            request["params"] = params
+        self._writer.write(json.dumps(request).encode() + b"\n")
+        await self._writer.drain()
+
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by node")
+
+        response = json.loads(line)
+        if response.get("id") != self._id:
+            raise ValueError("Unexpected response id {}".format(response.get("id")))
+        if "error" in response:
+            raise RpcError(response["error"].get("code"), response["error"].get("message"))
+        return response["result"]
+
+    async def poll(self):
+        """
+        Fetch get_status, unless the node is backing off after a failure
+        """
+        if time.monotonic() < self._retry_at:
+            return
+
+        try:
+            status = await asyncio.wait_for(self.call("get_status"), self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.close()
+            self.failures += 1
+            self.error = str(e) or e.__class__.__name__
+            delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+            self._retry_at = time.monotonic() + delay
+            self._logger.debug("Poll failed ({}), retry in {}s".format(self.error, delay))
+            return
+
+        self.status = status
+        self.updated = time.time()
+        self.error = None
+        self.failures = 0
+
+    def dict(self, stale_after=30.0, now=None):
+        now = now or time.time()
+        age = None if self.updated is None else now - self.updated
+        return {
+            "node": self.name,
+            "status": self.status,
+            "updated": self.updated,
+            "age": age,
+            "stale": age is None or age > stale_after,
+            "error": self.error,
+            "failures": self.failures
+        }
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+
+class Fleet:
+    """
+    Polls every node concurrently and keeps the merged view, encoded once
+    per poll for every client asking for it
+    """
+
+    def __init__(self, nodes, stale_after=30.0):
+        self.nodes = list(nodes)
+        self.stale_after = stale_after
+        self.view = self._view()
+
+    def _view(self):
+        now = time.time()
+        nodes = [node.dict(self.stale_after, now) for node in self.nodes]
+        return RawJSON({
+            "nodes": nodes,
+            "stale": sum(1 for node in nodes if node["stale"]),
+            "time": str(int(now))
+        })
+
+    async def poll(self):
+        await asyncio.gather(*[node.poll() for node in self.nodes])
+        self.view = self._view()
+
+    def get(self, name):
+        for node in self.view.data["nodes"]:
+            if node["node"] == name:
+                return node
+        return None
+
+    def close(self):
+        for node in self.nodes:
+            node.close()
+
+
+async def poller(fleet, scheduler=None):
+    logger = logging.getLogger("rpioalert.aggregate.poller")
+    scheduler = scheduler or Scheduler(5.0)
+
+    try:
+        scheduler.start()
+        while True:
+            try:
+                await fleet.poll()
+                logger.debug("{} nodes, {} stale".format(
+                    len(fleet.nodes), fleet.view.data["stale"]))
+            except asyncio.CancelledError:
+                raise
+            except:
+                logger.debug(sys.exc_info())
+            await scheduler.sleep()
+    finally:
+        fleet.close()
+
+
+async def aggregate_server(fleet, listen="0.0.0.0", port=15556, max_connections=16):
+    logger = logging.getLogger("rpioalert.aggregate.rpc_server")
+
+    async def get_fleet(params):
+        return fleet.view
+
+    async def get_node(params):
+        node = fleet.get(params.get("node"))
+        if node is None:
+            raise RpcError(INVALID_PARAMS, "Unknown node")
+        return node
+
+    server = RpcServer(max_connections=max_connections)
+    server.register("get_fleet", get_fleet)
+    server.register("get_node", get_node)
+
+    try:
+        logger.info("Start aggregate rpc server, listening on {}:{}".format(listen, port))
+        await server.start(listen, port)
+    except:
+        logger.info(sys.exc_info())
+
+
+async def shutdown(task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="rpioalert aggregate",
+                                     description="Poll many rpioalert nodes, serve the merged view")
+    parser.add_argument("-v", "--verbose", help="Log verbosity",
+                        action="store_true", default=False)
+    parser.add_argument("--node", help="Node rpc address, host[:port], can be repeated",
+                        action="append", default=[])
+    parser.add_argument("--nodes", help="File with one node rpc address per line", type=str, default=None)
+    parser.add_argument("--interval", help="Seconds between polls, default 5", type=float, default=5.0)
+    parser.add_argument("--timeout", help="Per node timeout in seconds, default 2", type=float, default=2.0)
+    parser.add_argument("--backoff", help="Seconds before polling a failed node again, doubled after each failure, default 1",
+                        type=float, default=1.0)
+    parser.add_argument("--max_backoff", help="Maximum seconds between polls of a failed node, default 60",
+                        type=float, default=60.0)
+    parser.add_argument("--stale", help="Seconds after which a node status is marked stale, default 30",
+                        type=float, default=30.0)
+    parser.add_argument("--rpc_listen", help="Listen address, default all 0.0.0.0", type=str, default="0.0.0.0")
+    parser.add_argument("--rpc_port", help="Listen port, default 15556", type=int, default=15556)
+    parser.add_argument("--rpc_max_connections", help="Maximum concurrent rpc connections, default 16",
+                        type=int, default=16)
+    args = parser.parse_args(argv)
+
+    addresses = list(args.node)
+    if args.nodes:
+        try:
+            with open(args.nodes) as fp:
+                addresses += [line.strip() for line in fp
+                              if line.strip() and not line.startswith("#")]
+        except OSError as e:
+            parser.error(str(e))
+    if not addresses:
+        parser.error("No node, use --node or --nodes")
+    if args.interval <= 0:
+        parser.error("Intervals must be greater than 0")
+
+    try:
+        nodes = [Node(*parse_node(address), **{
+            "timeout": args.timeout,
+            "backoff": args.backoff,
+            "max_backoff": args.max_backoff
+        }) for address in addresses]
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)-8s %(name)-30s %(message)s"
+    )
+    logger = logging.getLogger("rpioalert.aggregate")
+
+    loop = asyncio.get_event_loop()
+    fleet = Fleet(nodes, args.stale)
+    tasks = [
+        asyncio.ensure_future(poller(fleet, Scheduler(args.interval))),
+        asyncio.ensure_future(aggregate_server(**{
+            "fleet": fleet,
+            "listen": args.rpc_listen,
+            "port": args.rpc_port,
+            "max_connections": args.rpc_max_connections
+        }))
+    ]
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+    try:
+        logger.info("Start rpioalert aggregate, {} nodes".format(len(nodes)))
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    except:
+        logger.debug(sys.exc_info())
+
+    logger.info("Stop rpioalert aggregate")
+    try:
+        loop.run_until_complete(asyncio.gather(
+            *[shutdown(t) for t in tasks], return_exceptions=True))
+    finally:
+        loop.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+import asyncio
+import os
+import time
+
+from .temper import Reading, SerialReply, Temper, USBRead, device_id
+
+
+class AsyncUSBRead(USBRead):
+    """
+    Asyncio counterpart of USBRead
+
+    The hidraw/tty file descriptor is put in non-blocking mode and replies
+    are collected with loop.add_reader, so a read never blocks the event loop
+    or needs an executor thread. Sessions and decoding are shared with
+    USBRead.
+    """
+
+    def __init__(self, device, verbose=False, timeout=1.0, devpath="/dev", loop=None):
+        super().__init__(device, verbose, timeout, devpath)
+        self._loop = loop or asyncio.get_event_loop()
+
+    async def _collect(self, fd, complete, size, gap=None):
+        """
+        Read from fd whenever it is readable until complete(buffer, data) is
+        True or timeout seconds have passed, return whatever has been received
+        With gap, also stop when nothing follows a whole report within gap
+        seconds
+        """
+        buffer = bytearray()
+        done = self._loop.create_future()
+        timer = None
+
+        def finish():
+            if not done.done():
+                done.set_result(None)
+
+        def on_readable():
+            try:
+                data = os.read(fd, size)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if not done.done():
+                    done.set_exception(e)
+                return
+
+            buffer.extend(data)
+            if not data or complete(buffer, data):
+                finish()
+            elif gap is not None and len(buffer) >= self.REPORT_SIZE:
+                nonlocal timer
+                if timer is not None:
+                    timer.cancel()
+                timer = self._loop.call_later(gap, finish)
+
+        self._loop.add_reader(fd, on_readable)
+        try:
+            await asyncio.wait_for(done, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._loop.remove_reader(fd)
+            if timer is not None:
+                timer.cancel()
+
+        return bytes(buffer)
+
+    def _drain_nonblocking(self, fd):
+        while True:
+            try:
+                if not os.read(fd, self.REPORT_SIZE):
+                    return
+            except BlockingIOError:
+                return
+
+    async def _exchange_async(self, fd, command, length, gap=None):
+        self._drain_nonblocking(fd)
+        os.write(fd, command)
+        return await self._collect(
+            fd, lambda buffer, data: len(buffer) >= length, self.REPORT_SIZE, gap)
+
+    async def _read_hidraw_async(self, device):
+        try:
+            if self._firmware is None:
+                if self._fd is None:
+                    self._fd = os.open(os.path.join(self.devpath, device),
+                                       os.O_RDWR | os.O_NONBLOCK)
+
+                firmware = await self._exchange_async(
+                    self._fd, self.FIRMWARE_COMMAND, self.FIRMWARE_LENGTH)
+                if not self._set_firmware(firmware):
+                    return Reading(error="Cannot read firmware identifier from device")
+
+            data = await self._exchange_async(
+                self._fd, self.DATA_COMMAND, self._data_length, self.REPORT_GAP)
+        except OSError as e:
+            self.close()
+            return Reading(error="Cannot read from device: {}".format(e))
+
+        return self._decode_hidraw(data)
+
+    async def _serial_exchange_async(self, command, lines):
+        reply = SerialReply(lines)
+        self._serial.reset_input_buffer()
+        self._serial.write(command)
+        await self._collect(self._serial.fileno(),
+                            lambda buffer, data: reply.feed(data), 64)
+        return reply
+
+    async def _read_serial_async(self, device):
+        error = None
+        for _ in range(2):
+            try:
+                if self._firmware is None:
+                    self._serial = self._open_serial(device, timeout=0)
+                    version = await self._serial_exchange_async(b"Version", 1)
+                    if not self._set_serial_firmware(version):
+                        return Reading(error="Cannot read firmware version from device")
+
+                reply = await self._serial_exchange_async(b"ReadTemp", 2)
+            except OSError as e:
+                self.close()
+                error = e
+                continue
+
+            firmware = str(self._firmware, "latin-1")
+            if not reply.complete:
+                self.close()
+            return self._decode_serial(firmware, reply.text())
+
+        return Reading(error="Cannot read from device: {}".format(error))
+
+    async def read(self):
+        if self.device.startswith("hidraw"):
+            return await self._read_hidraw_async(self.device)
+        if self.device.startswith("tty"):
+            return await self._read_serial_async(self.device)
+        return Reading(error="No usable hid/tty devices available")
+
+
+class AsyncTemper(Temper):
+    """
+    Asyncio counterpart of Temper.read
+
+    All known devices are read concurrently on the event loop, each bounded by
+    device_timeout. read_times holds the time each device took on the last
+    read, by device id. With health, a Health, devices failing repeatedly
+    are only probed on its backoff schedule and their last good reading is
+    reused meanwhile
+    """
+
+    def __init__(self, verbose=False, timeout=1.0, device_timeout=None,
+                 syspath=None, devpath="/dev", loop=None, health=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self.read_times = {}
+        self.health = health
+        super().__init__(verbose, timeout, device_timeout, syspath, devpath)
+
+    def _new_reader(self, device, verbose=False):
+        return AsyncUSBRead(device, verbose, self.timeout, self.devpath,
+                            loop=self._loop)
+
+    async def _read_device_async(self, info, verbose=False):
+        if len(info["devices"]) == 0:
+            return Reading(error="no hid/tty devices available")
+
+        usbread = self._get_reader(info["devices"][-1], verbose)
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(usbread.read(), self.device_timeout)
+        except asyncio.TimeoutError:
+            return Reading(error="Timed out reading from device")
+        except Exception as e:
+            return Reading(error="Cannot read from device: {}".format(e))
+        finally:
+            self.read_times[device_id(info)] = time.perf_counter() - start
+
+    async def read(self, verbose=False):
+        devices = self._known_devices()
+        self.read_times = {}
+        if self.health is None:
+            readings = await asyncio.gather(
+                *[self._read_device_async(info, verbose) for info in devices])
+            return [reading.attach(info) for info, reading in zip(devices, readings)]
+
+        ids = [device_id(info) for info in devices]
+        self.health.prune(ids)
+        now = time.monotonic()
+        polled = [(device, info) for device, info in zip(ids, devices)
+                  if self.health.allow(device, now)]
+        readings = await asyncio.gather(
+            *[self._read_device_async(info, verbose) for device, info in polled])
+        results = dict(zip([device for device, info in polled], readings))
+        return [self.health.update(device, results.get(device)).attach(info)
+                for device, info in zip(ids, devices)]
@@ -0,0 +1,498 @@
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import platform
+import selectors
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+from .aiotemper import AsyncTemper
+from .condition import Condition
+from .history import History
+from .pins import Pins
+from .profiler import Profiler
+from .scheduler import Scheduler
+from .snapshot import Publisher, Snapshot
+
+# (vendor id, product id, firmware) of the emulated devices, used in turn
+HIDRAW_MODELS = [
+    (0x413d, 0x2107, b"TEMPerX_V3.1\0\0\0\0"),
+    (0x413d, 0x2107, b"TEMPerGold_V3.1\0"),
+    (0x0c45, 0x7401, b"TEMPerF1.4\0\0\0\0\0\0")
+]
+CH340 = (0x1a86, 0x5523)
+
+CONDITIONS = {
+    "single": ["temp:gt:30"],
+    "four": ["temp:gt:30", "hum:gt:70:or", "temp:lt:10:or", "hum:lt:20:and"],
+    "grouped": ["temp:gte:30 and (hum:gte:70 or hum:lt:20) xor temp:lt:5", "or hum:eq:50"]
+}
+
+
+class Emulator:
+    """
+    One sensor behind a pty in raw mode, answering commands with reply()
+    """
+
+    def __init__(self, temperature=24.5, humidity=45.0):
+        self.temperature = temperature
+        self.humidity = humidity
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self._buffer = b""
+
+    def feed(self, data):
+        """
+        return the replies to the commands completed by data
+        """
+        self._buffer += data
+        replies = []
+        while True:
+            reply = self.reply()
+            if reply is None:
+                return replies
+            replies.append(reply)
+
+    def reply(self):
+        raise NotImplementedError
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class HidrawEmulator(Emulator):
+    """
+    TEMPerX/Gold/F1.4 hidraw device, 8 byte command reports
+    """
+
+    def __init__(self, firmware, temperature=24.5, humidity=45.0):
+        super().__init__(temperature, humidity)
+        self.firmware = firmware
+
+    def data(self):
+        if self.firmware.startswith(b"TEMPerF1.4"):
+            return struct.pack(">BBhhBB", 0x80, 0x01, int(self.temperature * 256), 0, 0, 0)
+        if self.firmware.startswith(b"TEMPerGold"):
+            return struct.pack(">BBhhBB", 0x80, 0x01, int(self.temperature * 100), 0, 0, 0)
+        return struct.pack(">BBhhBBBBhhBB",
+                           0x80, 0x80, int(self.temperature * 100), int(self.humidity * 100), 0, 0,
+                           0x80, 0x80, 0x4e20, 0x4e20, 0, 0)
+
+    def reply(self):
+        if len(self._buffer) < 8:
+            return None
+        command, self._buffer = self._buffer[:8], self._buffer[8:]
+        return self.firmware if command[1] == 0x86 else self.data()
+
+
+class SerialEmulator(Emulator):
+    """
+    CH340 based device, text commands and CRLF terminated replies
+    """
+
+    def reply(self):
+        for command in [b"Version", b"ReadTemp"]:
+            if self._buffer.startswith(command):
+                self._buffer = self._buffer[len(command):]
+                if command == b"Version":
+                    return b"TEMPerX232_V2.0\r\n"
+                return "Temp-Inner:{:.2f} [C],{:.2f} [%RH]\r\nTemp-Outer:NC\r\n".format(
+                    self.temperature, self.humidity).encode()
+        if len(self._buffer) > 64:
+            self._buffer = b""
+        return None
+
+
+class Hardware:
+    """
+    Simulated USB sensors: a /sys/bus/usb/devices like tree and a /dev
+    directory of links to emulated devices, served by one thread
+
+    latency delays every reply, like a real device takes a few milliseconds
+    to answer.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.root = tempfile.mkdtemp(prefix="rpioalert-benchmark-")
+        self.syspath = os.path.join(self.root, "sys")
+        self.devpath = os.path.join(self.root, "dev")
+        os.makedirs(self.syspath)
+        os.makedirs(self.devpath)
+        self.emulators = {}
+        self._selector = selectors.DefaultSelector()
+        self._stop = False
+        self._thread = None
+        self._hidraw = 0
+        self._tty = 0
+        self._devnum = 2
+
+    def _add_usb(self, vendorid, productid, node, interface):
+        name = "1-{}".format(self._devnum - 1)
+        path = os.path.join(self.syspath, name)
+        os.makedirs(os.path.join(path, interface.format(name=name), node))
+        for filename, value in [("idVendor", "{:04x}".format(vendorid)),
+                                ("idProduct", "{:04x}".format(productid)),
+                                ("busnum", "1"), ("devnum", str(self._devnum)),
+                                ("product", "TEMPer"), ("manufacturer", "RDing")]:
+            with open(os.path.join(path, filename), "w") as fp:
+                fp.write(value + "\n")
+        self._devnum += 1
+
+    def _attach(self, emulator, node):
+        os.symlink(emulator.path, os.path.join(self.devpath, node))
+        self.emulators[emulator.master] = emulator
+        self._selector.register(emulator.master, selectors.EVENT_READ, emulator)
+
+    def add_hidraw(self, model=0, **kwargs):
+        vendorid, productid, firmware = HIDRAW_MODELS[model % len(HIDRAW_MODELS)]
+        node = "hidraw{}".format(self._hidraw)
+        self._hidraw += 1
+        emulator = HidrawEmulator(firmware, **kwargs)
+        self._add_usb(vendorid, productid, "hidraw/" + node,
+                      "{name}:1.1/0003:%04X:%04X.0001" % (vendorid, productid))
+        self._attach(emulator, node)
+        return emulator
+
+    def add_serial(self, **kwargs):
+        node = "ttyUSB{}".format(self._tty)
+        self._tty += 1
+        emulator = SerialEmulator(**kwargs)
+        self._add_usb(*CH340, node, "{name}:1.0")
+        self._attach(emulator, node)
+        return emulator
+
+    def add(self, count, serial_every=4):
+        """
+        Add count devices, every serial_every-th one a CH340 (0 for none)
+        """
+        for i in range(count):
+            if serial_every and i % serial_every == serial_every - 1:
+                self.add_serial()
+            else:
+                self.add_hidraw(i)
+
+    def _run(self):
+        # (due time, order, fd, reply) of the delayed replies
+        pending = []
+        order = 0
+        while not self._stop:
+            timeout = 0.1
+            if pending:
+                timeout = max(0.0, min(timeout, pending[0][0] - time.monotonic()))
+
+            for key, _ in self._selector.select(timeout):
+                try:
+                    data = os.read(key.fd, 64)
+                except OSError:
+                    continue
+                for reply in key.data.feed(data):
+                    heapq.heappush(pending, (time.monotonic() + self.latency, order, key.fd, reply))
+                    order += 1
+
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                _, _, fd, reply = heapq.heappop(pending)
+                try:
+                    os.write(fd, reply)
+                except OSError:
+                    pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="hardware", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join()
+        self._selector.close()
+        for emulator in self.emulators.values():
+            emulator.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeLcd:
+    """
+    Character LCD backend keeping the displayed cells in memory and counting
+    the characters and commands written
+    """
+
+    def __init__(self, columns=16, rows=2):
+        self.columns = columns
+        self.rows = [[" "] * columns for _ in range(rows)]
+        self.color = [0, 0, 0]
+        self.characters = 0
+        self.commands = 0
+        self._column = 0
+        self._row = 0
+
+    def cursor_position(self, column, row):
+        self._column, self._row = column, row
+        self.commands += 1
+
+    @property
+    def message(self):
+        return "\n".join("".join(row) for row in self.rows)
+
+    @message.setter
+    def message(self, message):
+        column, row = self._column, self._row
+        for character in message:
+            if character == "\n":
+                column, row = 0, row + 1
+                self.commands += 1
+                continue
+            if row < len(self.rows) and column < self.columns:
+                self.rows[row][column] = character
+            column += 1
+            self.characters += 1
+        self._column, self._row = 0, 0
+
+    def clear(self):
+        self.rows = [[" "] * self.columns for _ in self.rows]
+        self.commands += 1
+
+
+class SampleProfiler(Profiler):
+    """
+    Profiler also keeping every sample, for exact percentiles
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.samples = {}
+
+    def observe(self, name, seconds):
+        super().observe(name, seconds)
+        self.samples.setdefault(name, []).append(seconds)
+
+
+def percentile(samples, q):
+    """
+    Nearest rank percentile of samples, q between 0 and 100
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(1, int(round(q / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _latency(results, name, samples):
+    for q in [50, 90, 99]:
+        results["{}.p{}_ms".format(name, q)] = {
+            "value": 1000 * percentile(samples, q), "unit": "ms", "higher_is_better": False}
+
+
+async def bench_read(devices, reads, latency=0.0):
+    """
+    Read devices emulated sensors reads times with AsyncTemper
+    """
+    results = {}
+    with Hardware(latency) as hardware:
+        hardware.add(devices)
+        temper = AsyncTemper(device_timeout=2.0, syspath=hardware.syspath, devpath=hardware.devpath)
+        try:
+            # Open the sessions and identify the firmwares first
+            await temper.read()
+
+            samples = []
+            errors = 0
+            start = time.perf_counter()
+            for _ in range(reads):
+                read_start = time.perf_counter()
+                readings = await temper.read()
+                samples.append(time.perf_counter() - read_start)
+                errors += sum(1 for r in readings if r.error is not None)
+            elapsed = time.perf_counter() - start
+        finally:
+            temper.close()
+
+    name = "read.{}".format(devices)
+    _latency(results, name, samples)
+    results[name + ".readings_per_s"] = {
+        "value": devices * reads / elapsed, "unit": "1/s", "higher_is_better": True}
+    results[name + ".errors"] = {"value": errors, "unit": "", "higher_is_better": False}
+    return results
+
+
+async def bench_tick(devices, ticks, latency=0.0):
+    """
+    Run rpio_alert against emulated sensors, mock GPIO pins and a fake LCD
+    """
+    from gpiozero import Device, LED
+    from gpiozero.pins.mock import MockFactory
+
+    from .__main__ import Lcd, Status, rpio_alert
+
+    Device.pin_factory = MockFactory()
+    results = {}
+    with Hardware(latency) as hardware:
+        hardware.add(devices)
+        fake_lcd = FakeLcd()
+        pins = Pins([LED(pin) for pin in [17, 27]])
+        stats = Status(lcd=Lcd(backend=fake_lcd))
+        off_condition = Condition(["temp:lt:20"])
+        on_condition = Condition(CONDITIONS["grouped"])
+        publisher = Publisher(Snapshot(stats, pins, off_condition, on_condition))
+        profiler = SampleProfiler()
+
+        task = asyncio.ensure_future(rpio_alert(**{
+            "pins": pins,
+            "stats": stats,
+            "off_condition": off_condition,
+            "on_condition": on_condition,
+            "lock": asyncio.Lock(),
+            "history": History(),
+            "publisher": publisher,
+            "scheduler": Scheduler(0.001),
+            "profiler": profiler,
+            "temper": AsyncTemper(device_timeout=2.0, syspath=hardware.syspath,
+                                  devpath=hardware.devpath)
+        }))
+        try:
+            # The first tick opens the devices, leave it out
+            while len(profiler.samples.get("tick", [])) < ticks + 1:
+                if task.done():
+                    task.result()
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            pins.close()
+
+    name = "tick.{}".format(devices)
+    _latency(results, name, profiler.samples["tick"][1:ticks + 1])
+    for stage in ["read", "toggle", "publish", "lcd"]:
+        samples = profiler.samples.get(stage, [])[1:]
+        if samples:
+            results["{}.{}.mean_us".format(name, stage)] = {
+                "value": 1e6 * sum(samples) / len(samples), "unit": "us", "higher_is_better": False}
+    results[name + ".lcd_characters_per_tick"] = {
+        "value": fake_lcd.characters / len(profiler.samples["tick"]), "unit": "", "higher_is_better": False}
+    return results
+
+
+def bench_condition(evaluations):
+    """
+    Cost of evaluating compiled conditions
+    """
+    results = {}
+    values = [(20.0 + i % 15, 30.0 + i % 50) for i in range(100)]
+    for name, arguments in sorted(CONDITIONS.items()):
+        condition = Condition(arguments)
+        start = time.perf_counter()
+        for _ in range(evaluations // len(values)):
+            for temperature, humidity in values:
+                condition(temperature, humidity)
+        elapsed = time.perf_counter() - start
+        results["condition.{}.ns".format(name)] = {
+            "value": 1e9 * elapsed / (evaluations // len(values) * len(values)),
+            "unit": "ns", "higher_is_better": False}
+    return results
+
+
+def run(devices=[1, 2, 4, 8, 16, 32], reads=50, ticks=200, tick_devices=4, evaluations=100000, latency=0.0):
+    loop = asyncio.get_event_loop()
+    results = {}
+    for count in devices:
+        results.update(loop.run_until_complete(bench_read(count, reads, latency)))
+    results.update(loop.run_until_complete(bench_tick(tick_devices, ticks, latency)))
+    results.update(bench_condition(evaluations))
+    return results
+
+
+def compare(baseline, results, tolerance):
+    """
+    return [(name, baseline, current, change, regressed)] of the results
+    found in both, change relative to the baseline
+    """
+    rows = []
+    for name, result in sorted(results.items()):
+        if name not in baseline or not baseline[name]["value"]:
+            continue
+        old = baseline[name]["value"]
+        new = result["value"]
+        change = (new - old) / old
+        if result["higher_is_better"]:
+            regressed = change < -tolerance
+        else:
+            regressed = change > tolerance
+        rows.append((name, old, new, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rpioalert against simulated sensors, pins and LCD")
+    parser.add_argument("--devices", help="Device counts for the read benchmark, default 1,2,4,8,16,32",
+                        type=lambda x: [int(i) for i in x.split(",")], default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--reads", help="Reads per device count, default 50", type=int, default=50)
+    parser.add_argument("--ticks", help="Ticks for the tick benchmark, default 200", type=int, default=200)
+    parser.add_argument("--tick_devices", help="Devices for the tick benchmark, default 4", type=int, default=4)
+    parser.add_argument("--evaluations", help="Condition evaluations, default 100000", type=int, default=100000)
+    parser.add_argument("--latency", help="Simulated device reply latency in seconds, default 0", type=float, default=0.0)
+    parser.add_argument("--json", help="Write the results to this file, to use as a baseline", type=str, default=None)
+    parser.add_argument("--compare", help="Compare with a baseline written by --json", type=str, default=None)
+    parser.add_argument("--tolerance", help="Relative change considered a regression, default 0.2", type=float, default=0.2)
+    args = parser.parse_args()
+
+    parameters = {
+        "devices": args.devices,
+        "reads": args.reads,
+        "ticks": args.ticks,
+        "tick_devices": args.tick_devices,
+        "evaluations": args.evaluations,
+        "latency": args.latency
+    }
+    results = run(**parameters)
+
+    for name, result in sorted(results.items()):
+        print("{:<40} {:>14.3f} {}".format(name, result["value"], result["unit"]))
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": int(time.time()),
+                "parameters": parameters,
+                "results": results
+            }, fp, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+        regressions = 0
+        print()
+        if baseline.get("parameters") != parameters:
+            print("Warning: baseline parameters differ {}".format(baseline.get("parameters")))
+        baseline = baseline["results"]
+        for name, old, new, change, regressed in compare(baseline, results, args.tolerance):
+            regressions += regressed
+            print("{:<40} {:>14.3f} {:>14.3f} {:>+8.1%}{}".format(
+                name, old, new, change, "  REGRESSION" if regressed else ""))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import operator
+import re
+
+COMPARISONS = {
+    "eq": operator.eq,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le
+}
+
+LOGIC_GATES = {
+    "and": lambda left, right: left and right,
+    "or": lambda left, right: left or right,
+    "xor": lambda left, right: left != right,
+    "nand": lambda left, right: not (left and right),
+    "nor": lambda left, right: not (left or right),
+    "xnor": lambda left, right: left == right
+}
+
+# Inside an expression AND binds tighter than XOR, which binds tighter than OR
+PRECEDENCE = {
+    "and": 3,
+    "nand": 3,
+    "xor": 2,
+    "xnor": 2,
+    "or": 1,
+    "nor": 1
+}
+
+VALUE_TYPES = {
+    "t": "temperature",
+    "temp": "temperature",
+    "temperature": "temperature",
+    "h": "humidity",
+    "hum": "humidity",
+    "humidity": "humidity"
+}
+
+TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+class ConditionError(ValueError):
+    pass
+
+
+class _Compare:
+    __slots__ = ("text", "metric", "comparison", "value", "evaluate")
+
+    def __init__(self, text):
+        parts = text.split(":")
+        if len(parts) != 3:
+            raise ConditionError(
+                "Invalid condition '{}', format: <temp|hum>:<eq|lt|lte|gt|gte>:<value>".format(text))
+
+        value_type, comparison, value = parts
+        if value_type not in VALUE_TYPES:
+            raise ConditionError("Invalid value type '{}' in '{}'".format(value_type, text))
+        if comparison not in COMPARISONS:
+            raise ConditionError("Invalid comparison '{}' in '{}'".format(comparison, text))
+        try:
+            value = float(value)
+        except ValueError:
+            raise ConditionError("Invalid value '{}' in '{}'".format(value, text))
+
+        self.text = text
+        self.metric = VALUE_TYPES[value_type]
+        self.comparison = comparison
+        self.value = value
+
+        compare = COMPARISONS[comparison]
+        if self.metric == "temperature":
+            self.evaluate = lambda temperature, humidity: compare(temperature, value)
+        else:
+            self.evaluate = lambda temperature, humidity: compare(humidity, value)
+
+    def thresholds(self):
+        yield self.metric, self.value
+
+    def __str__(self):
+        return self.text
+
+
+class _Gate:
+    __slots__ = ("logic", "left", "right", "evaluate")
+
+    def __init__(self, logic, left, right):
+        self.logic = logic
+        self.left = left
+        self.right = right
+
+        gate = LOGIC_GATES[logic]
+        left = left.evaluate
+        right = right.evaluate
+        self.evaluate = lambda temperature, humidity: gate(
+            left(temperature, humidity), right(temperature, humidity))
+
+    def thresholds(self):
+        yield from self.left.thresholds()
+        yield from self.right.thresholds()
+
+    def __str__(self):
+        return "{} {} {}".format(*[
+            "({})".format(node) if isinstance(node, _Gate) else str(node)
+            for node in (self.left, self.logic, self.right)])
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = TOKEN.findall(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ConditionError("Unexpected end of condition '{}'".format(self.text))
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.expression(1)
+        if self.peek() is not None:
+            raise ConditionError("Unexpected '{}' in condition '{}'".format(self.peek(), self.text))
+        return node
+
+    def expression(self, min_precedence):
+        node = self.operand()
+        while self.peek() in PRECEDENCE and PRECEDENCE[self.peek()] >= min_precedence:
+            logic = self.next()
+            right = self.expression(PRECEDENCE[logic] + 1)
+            node = _Gate(logic, node, right)
+        return node
+
+    def operand(self):
+        token = self.next()
+        if token == "(":
+            node = self.expression(1)
+            if self.next() != ")":
+                raise ConditionError("Missing ')' in condition '{}'".format(self.text))
+            return node
+        if token == ")" or token in PRECEDENCE:
+            raise ConditionError("Unexpected '{}' in condition '{}'".format(token, self.text))
+        return _Compare(token)
+
+
+def _compile_argument(argument):
+    """
+    Compile one --on/--off argument, return (logic, node)
+
+    logic joins the argument to the ones before it. A plain
+    <temp|hum>:<op>:<value>:<logic> argument carries it as suffix, an
+    expression may start with it, e.g. "or (temp:gt:30 and hum:gt:70)"
+    """
+    tokens = TOKEN.findall(argument)
+    if not tokens:
+        raise ConditionError("Empty condition")
+
+    if len(tokens) == 1 and tokens[0].count(":") == 3:
+        text, logic = tokens[0].rsplit(":", 1)
+        if logic not in LOGIC_GATES:
+            raise ConditionError("Invalid logic '{}' in '{}'".format(logic, argument))
+        return logic, _Compare(text)
+
+    logic = "and"
+    if tokens[0] in LOGIC_GATES:
+        logic = tokens[0]
+        argument = argument.strip()[len(logic):]
+
+    return logic, _Parser(argument).parse()
+
+
+class Condition:
+    """
+    Compiled --on/--off condition
+
+    Arguments are combined left to right, each with its own logic gate (AND
+    by default), as they always have been. An argument may also be a
+    parenthesised expression, e.g. "temp:gt:30 and (hum:gt:70 or hum:lt:20)",
+    evaluated with AND before XOR before OR.
+
+    Compiling validates every argument and raises ConditionError, calling the
+    compiled condition is a handful of float comparisons. An empty condition
+    evaluates to None.
+    """
+
+    def __init__(self, conditions=[]):
+        self.conditions = list(conditions)
+        self._root = None
+
+        for argument in self.conditions:
+            logic, node = _compile_argument(argument)
+            if self._root is None:
+                self._root = node
+            else:
+                self._root = _Gate(logic, self._root, node)
+
+        if self._root is None:
+            self.evaluate = lambda temperature, humidity: None
+        else:
+            self.evaluate = self._root.evaluate
+
+    def __call__(self, temperature, humidity):
+        return self.evaluate(temperature, humidity)
+
+    def __bool__(self):
+        return self._root is not None
+
+    def thresholds(self):
+        """
+        Return [(metric, value)] of every comparison in the condition
+        """
+        if self._root is None:
+            return []
+        return list(self._root.thresholds())
+
+    def __str__(self):
+        if self._root is None:
+            return "None"
+        return str(self._root)
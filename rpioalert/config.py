@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import sys
+
+from .condition import Condition
+from .drivers import LCD_DRIVERS, led
+from .pins import Pins
+from .zone import Zone, parse_zone
+
+# --config keys, the command line option names, with their type
+SCHEMA = {
+    "rpc": bool,
+    "verbose": bool,
+    "off_first": bool,
+    "lcd": str,
+    "pin": [int],
+    "off": [str],
+    "on": [str],
+    "zone": [dict],
+    "rpc_listen": str,
+    "rpc_port": int,
+    "rpc_max_connections": int,
+    "history_size": int,
+    "store": str,
+    "store_flush": int,
+    "read_timeout": float,
+    "device_failures": int,
+    "device_backoff": float,
+    "device_max_backoff": float,
+    "stale_ttl": float,
+    "interval": float,
+    "min_interval": float,
+    "max_interval": float,
+    "adaptive_margin": float,
+    "profile": bool,
+    "metrics_listen": str,
+    "metrics_port": int,
+    "shm": str
+}
+
+# Settings applied by a reload, the others need a restart
+RELOADABLE = ["off_first", "lcd", "pin", "off", "on", "zone", "read_timeout",
+              "device_failures", "device_backoff", "device_max_backoff", "stale_ttl",
+              "interval", "min_interval", "max_interval", "adaptive_margin"]
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _check(key, value, kind):
+    if isinstance(kind, list):
+        if not isinstance(value, list):
+            value = [value]
+        return [_check(key, v, kind[0]) for v in value]
+
+    if value is None and kind is not bool:
+        return None
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if kind is int and isinstance(value, bool) or not isinstance(value, kind):
+        raise ConfigError("Invalid {} '{}', expected {}".format(key, value, kind.__name__))
+    return value
+
+
+def load_config(path):
+    """
+    Read a JSON config file of command line settings, e.g.
+    {"pin": [17], "on": ["temp:gte:30"], "off": ["temp:lt:28"], "interval": 5}
+    return the checked settings as a dict, raise ConfigError
+    """
+    try:
+        with open(path) as fp:
+            config = json.load(fp)
+    except (OSError, ValueError) as e:
+        raise ConfigError("Unable to read config {}: {}".format(path, e))
+
+    if not isinstance(config, dict):
+        raise ConfigError("Invalid config {}, expected an object".format(path))
+
+    unknown = set(config) - set(SCHEMA)
+    if unknown:
+        raise ConfigError("Unknown setting {} in config {}".format(", ".join(sorted(unknown)), path))
+
+    return {key: _check(key, value, SCHEMA[key]) for key, value in config.items()}
+
+
+class Setup:
+    """
+    Pins, zones and settings built from the command line and --config
+
+    The default zone and the zones list are shared with rpio_alert and
+    updated in place by reload(), which applies the difference with the
+    running settings: conditions are only compiled for rules that changed,
+    only the GPIO pins added are opened and only the ones removed are
+    closed, zones whose sensors did not change are kept. Temper sessions,
+    the scheduler grid and rpc connections are left as they are.
+    """
+
+    def __init__(self, parser, argv=None, lcd=None, scheduler=None, temper=None,
+                 lock=None, executor=None, loop=None):
+        self.parser = parser
+        self.argv = argv
+        self.lcd = lcd
+        self.scheduler = scheduler
+        self.temper = temper
+        self.lock = lock
+        self.executor = executor
+        self.loop = loop
+        self.args = None
+        self.default = Zone("default", Pins([]))
+        self.zones = []
+        self._defaults = vars(parser.parse_args([]))
+        self._leds = {}
+        self._compiled = {}
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def parse(self):
+        """
+        Parse the command line over the --config settings, lists from both
+        are combined, other command line options override the file
+        return the arguments, raise ConfigError
+        """
+        self.parser.set_defaults(**self._defaults)
+        args = self.parser.parse_args(self.argv)
+        if args.config:
+            self.parser.set_defaults(**dict(self._defaults, **load_config(args.config)))
+            args = self.parser.parse_args(self.argv)
+        return args
+
+    def pins(self, args):
+        """
+        return the pin numbers of --pin and of every zone, without checking
+        anything else, a zone that cannot be read is skipped
+        """
+        numbers = list(args.pin)
+        for zone in args.zone:
+            try:
+                config = zone if isinstance(zone, dict) else json.loads(zone)
+                numbers += [int(pin) for pin in config.get("pins", [])]
+            except (AttributeError, TypeError, ValueError):
+                self._logger.info("Unable to read the pins of zone {}".format(zone))
+        return numbers
+
+    def condition(self, conditions):
+        """
+        return the compiled Condition, compiled again only when changed
+        """
+        key = tuple(conditions)
+        if key not in self._compiled:
+            self._compiled[key] = Condition(conditions)
+        return self._compiled[key]
+
+    def check(self, args):
+        """
+        Check the settings, return the parsed --zone settings
+        raise ConfigError or ConditionError
+        """
+        for interval in [args.interval, args.min_interval, args.max_interval]:
+            if interval is not None and interval <= 0:
+                raise ConfigError("Intervals must be greater than 0")
+        if args.device_failures < 1 or args.device_backoff <= 0 or args.device_max_backoff <= 0:
+            raise ConfigError("Device failures and backoffs must be greater than 0")
+        if args.lcd is not None and args.lcd not in LCD_DRIVERS:
+            raise ConfigError("Invalid lcd '{}'".format(args.lcd))
+
+        self.condition(args.off)
+        self.condition(args.on)
+        zone_configs = [parse_zone(zone, self.condition) for zone in args.zone]
+
+        names = [config["name"] for config in zone_configs]
+        if len(set(names)) != len(names):
+            raise ConfigError("Zone names must be unique")
+        zone_pins = [pin for config in zone_configs for pin in config["pins"]]
+        if len(set(zone_pins + args.pin)) != len(zone_pins + args.pin):
+            raise ConfigError("A pin can only be used by one zone")
+
+        return zone_configs
+
+    def _pins(self, pins, numbers):
+        if pins is not None and pins.numbers == numbers:
+            return pins
+
+        leds = []
+        for number in numbers:
+            if number not in self._leds:
+                try:
+                    self._leds[number] = led(number)
+                except:
+                    self._logger.info("Unable to connect to GPIO Pin {}".format(number))
+                    self._logger.debug(sys.exc_info())
+                    continue
+            leds.append(self._leds[number])
+        return Pins(leds)
+
+    def apply(self, args):
+        """
+        Update the pins, zones and scheduler to args
+        return the settings that changed, raise ConfigError or ConditionError
+        """
+        zone_configs = self.check(args)
+        changed = [key for key in SCHEMA if self.args is None or
+                   getattr(self.args, key, None) != getattr(args, key, None)]
+
+        self.default.pins = self._pins(self.default.pins, args.pin)
+        self.default.off_condition = self.condition(args.off)
+        self.default.on_condition = self.condition(args.on)
+        self.default.off_first = args.off_first
+
+        # --pin, --on and --off make the default zone, of every device
+        current = {zone.name: zone for zone in self.zones}
+        zones = []
+        if zone_configs and args.pin:
+            zones.append(self.default)
+        for config in zone_configs:
+            zone = current.get(config["name"])
+            pins = self._pins(zone.pins if zone else None, config.pop("pins"))
+            if zone is None or zone is self.default or zone.sensors != config["sensors"]:
+                zone = Zone(pins=pins, **config)
+            else:
+                zone.pins = pins
+                zone.off_condition = config["off_condition"]
+                zone.on_condition = config["on_condition"]
+                zone.off_first = config["off_first"]
+            zones.append(zone)
+        self.zones[:] = zones
+
+        used = set(self.default.pins.numbers + [
+            number for zone in zones for number in zone.pins.numbers])
+        for number in [number for number in self._leds if number not in used]:
+            output = self._leds.pop(number)
+            try:
+                output.off()
+                output.close()
+            except:
+                self._logger.debug(sys.exc_info())
+
+        used = [args.off, args.on] + [
+            zone.off_condition.conditions for zone in zones] + [
+            zone.on_condition.conditions for zone in zones]
+        self._compiled = {tuple(key): self.condition(key) for key in used}
+
+        if self.scheduler is not None:
+            self.scheduler.configure(**{
+                "interval": args.interval,
+                "min_interval": args.min_interval,
+                "max_interval": args.max_interval,
+                "margin": args.adaptive_margin,
+                "thresholds": [threshold for zone in zones or [self.default]
+                               for threshold in zone.thresholds()]
+            })
+        if self.temper is not None:
+            self.temper.device_timeout = args.read_timeout
+            health = getattr(self.temper, "health", None)
+            if health is not None:
+                health.threshold = args.device_failures
+                health.backoff = args.device_backoff
+                health.max_backoff = args.device_max_backoff
+                health.ttl = args.stale_ttl
+
+        self.args = args
+        return changed
+
+    async def reload(self):
+        """
+        Read the command line and --config again and apply the difference
+        return {"changed": [settings applied], "restart": [settings changed
+        that need a restart]}, raise ConfigError or ConditionError
+        """
+        args = self.parse()
+        if self.lock is not None:
+            await self.lock.acquire()
+        try:
+            changed = self.apply(args)
+            if "lcd" in changed and self.lcd is not None:
+                loop = self.loop or asyncio.get_event_loop()
+                await loop.run_in_executor(self.executor, self.lcd.reopen, args.lcd)
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+
+        result = {
+            "changed": [key for key in changed if key in RELOADABLE],
+            "restart": [key for key in changed if key not in RELOADABLE]
+        }
+        self._logger.info("Reloaded, changed: {}".format(", ".join(result["changed"]) or "none"))
+        if result["restart"]:
+            self._logger.warning("Restart to apply: {}".format(", ".join(result["restart"])))
+        return result
+
+    def close(self):
+        for output in self._leds.values():
+            try:
+                if not output.closed:
+                    output.off()
+                    output.close()
+            except:
+                self._logger.debug(sys.exc_info())
+        self._leds = {}
@@ -0,0 +1,85 @@
+import importlib
+import sys
+
+# Output drivers, each LCD type and the GPIO backend import their library
+# when first used: a run without --lcd never loads Blinka (board, busio)
+# and -stop only loads gpiozero
+
+
+def _set_bit(value, bit, set_to):
+    # Same as adafruit_character_lcd.character_lcd._set_bit
+    if set_to:
+        return value | (1 << bit)
+    return value & ~(1 << bit)
+
+
+def _i2c():
+    board = importlib.import_module("board")
+    busio = importlib.import_module("busio")
+    return busio.I2C(board.SCL, board.SDA)
+
+
+def _sainsmart_charlcd_led(columns, rows):
+    character_lcd_rgb_i2c = importlib.import_module("adafruit_character_lcd.character_lcd_rgb_i2c")
+    lcd = character_lcd_rgb_i2c.Character_LCD_RGB_I2C(_i2c(), columns, rows)
+    lcd._mcp.iodira = _set_bit(lcd._mcp.iodira, 5, 0)
+    return lcd
+
+
+def _adafruit_charlcd_mono(columns, rows):
+    character_lcd_i2c = importlib.import_module("adafruit_character_lcd.character_lcd_i2c")
+    return character_lcd_i2c.Character_LCD_I2C(_i2c(), columns, rows)
+
+
+def _adafruit_charlcd_rgb(columns, rows):
+    character_lcd_rgb_i2c = importlib.import_module("adafruit_character_lcd.character_lcd_rgb_i2c")
+    return character_lcd_rgb_i2c.Character_LCD_RGB_I2C(_i2c(), columns, rows)
+
+
+# --lcd choices, lcd_type: factory(columns, rows)
+LCD_DRIVERS = {
+    "sainsmart_charlcd_led": _sainsmart_charlcd_led,
+    "adafruit_charlcd_rgb": _adafruit_charlcd_rgb,
+    "adafruit_charlcd_mono": _adafruit_charlcd_mono
+}
+
+# LCD types with an RGB backlight
+RGB_LCD = ["adafruit_charlcd_rgb", "sainsmart_charlcd_led"]
+
+
+def open_lcd(lcd_type, columns=16, rows=2):
+    """
+    return the character LCD of lcd_type, raise KeyError on unknown type
+    """
+    return LCD_DRIVERS[lcd_type](columns, rows)
+
+
+def backlight(lcd, lcd_type, on):
+    """
+    Switch the backlight of LCD types driving it from a GPIO of the expander
+    """
+    if lcd_type == "sainsmart_charlcd_led":
+        # Active low
+        lcd._mcp.gpioa = _set_bit(lcd._mcp.gpioa, 5, 0 if on else 1)
+
+
+_led = None
+
+
+def led(pin):
+    """
+    return a gpiozero LED on pin, gpiozero is imported on the first call
+    """
+    global _led
+    if _led is None:
+        _led = importlib.import_module("gpiozero").LED
+    return _led(pin)
+
+
+def loaded():
+    """
+    return the driver libraries imported so far, for the startup report
+    """
+    return sorted(name for name in ["adafruit_character_lcd", "board", "busio", "gpiozero"]
+                  if name in sys.modules)
+
@@ -0,0 +1,127 @@
+import logging
+import time
+
+from .temper import Reading
+
+
+class Breaker:
+    """
+    Circuit breaker of one device
+
+    After failures consecutive failed reads the breaker opens, the device is
+    then only read again, as a probe, backoff seconds later, the delay
+    doubling after each failed probe up to max_backoff. A good read closes
+    it.
+    """
+
+    __slots__ = ("failures", "error", "retry_at", "last_good")
+
+    def __init__(self):
+        self.failures = 0
+        self.error = None
+        self.retry_at = None
+        self.last_good = None
+
+    def allow(self, now):
+        return self.retry_at is None or now >= self.retry_at
+
+    def success(self, reading):
+        self.failures = 0
+        self.error = None
+        self.retry_at = None
+        self.last_good = reading
+
+    def failure(self, error, now, threshold, backoff, max_backoff):
+        """
+        return the seconds until the next probe, None while still closed
+        """
+        self.failures += 1
+        self.error = error
+        if self.failures < threshold:
+            return None
+        delay = min(max_backoff, backoff * 2 ** (self.failures - threshold))
+        self.retry_at = now + delay
+        return delay
+
+
+class Health:
+    """
+    Health of every device, decides which devices are read on a tick
+
+    A device whose breaker is open is not read, its last good reading is
+    reused, marked stale, until it is older than ttl seconds. Past the ttl,
+    or without any good reading, the device is excluded: it is reported
+    with an error and left out of the averages.
+    """
+
+    def __init__(self, threshold=3, backoff=5.0, max_backoff=300.0, ttl=60.0):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ttl = ttl
+        self.breakers = {}
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def prune(self, devices):
+        """
+        Forget the devices no longer present
+        """
+        for device in set(self.breakers) - set(devices):
+            del self.breakers[device]
+
+    def allow(self, device, now=None):
+        breaker = self.breakers.get(device)
+        return breaker is None or breaker.allow(time.monotonic() if now is None else now)
+
+    def update(self, device, reading, now=None):
+        """
+        Record the reading of device, None when it was not read
+        return the reading to use: reading, the last good one marked stale,
+        or an error
+        """
+        now = time.monotonic() if now is None else now
+        breaker = self.breakers.get(device)
+        if breaker is None:
+            breaker = self.breakers[device] = Breaker()
+
+        if reading is not None:
+            # Only a reading with values is good, and kept to reuse later
+            if reading.error is None and reading.has_value():
+                if breaker.retry_at is not None:
+                    self._logger.info("Device {} recovered".format(device))
+                breaker.success(reading)
+                return reading
+
+            if reading.error is None:
+                reading.error = "No value read"
+            delay = breaker.failure(reading.error, now, self.threshold, self.backoff, self.max_backoff)
+            if delay is not None:
+                self._logger.info("Device {} failed {} times ({}), next probe in {}s".format(
+                    device, breaker.failures, reading.error, delay))
+
+        good = breaker.last_good
+        if good is not None and time.time() - good.time <= self.ttl:
+            stale = good.copy()
+            stale.stale = True
+            return stale
+        if reading is not None:
+            return reading
+        return Reading(error="Device excluded, last error: {}".format(breaker.error))
+
+    def dict(self):
+        now = time.monotonic()
+        devices = []
+        for device, breaker in sorted(self.breakers.items()):
+            age = None if breaker.last_good is None else time.time() - breaker.last_good.time
+            devices.append({
+                "device": device,
+                "state": "ok" if not breaker.failures else (
+                    "failing" if breaker.retry_at is None else "open"),
+                "failures": breaker.failures,
+                "error": breaker.error,
+                "age": age,
+                "stale": bool(breaker.failures) and age is not None and age <= self.ttl,
+                "excluded": bool(breaker.failures) and (age is None or age > self.ttl),
+                "retry_in": None if breaker.retry_at is None else max(0.0, breaker.retry_at - now)
+            })
+        return devices
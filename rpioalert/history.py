@@ -0,0 +1,194 @@
+from array import array
+from collections import deque
+
+
+class RingBuffer:
+    """
+    Fixed capacity buffer of (time, value) samples
+
+    Samples live in two preallocated array('d'), the oldest sample is
+    overwritten once the buffer is full. Rolling min/max/mean over the
+    buffer and an EWMA are maintained on every append in O(1) (amortized for
+    min/max), so reading them costs nothing.
+    """
+
+    __slots__ = ("capacity", "alpha", "_times", "_values", "_count", "_sum",
+                 "_ewma", "_min", "_max")
+
+    def __init__(self, capacity=3600, alpha=0.1):
+        self.capacity = capacity
+        self.alpha = alpha
+        self._times = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        # Total number of samples ever appended, sample n is at n % capacity
+        self._count = 0
+        self._sum = 0.0
+        self._ewma = None
+        # Monotonic queues of sample numbers, front is the current min/max
+        self._min = deque()
+        self._max = deque()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, time, value):
+        position = self._count % self.capacity
+        if self._count >= self.capacity:
+            self._sum -= self._values[position]
+
+        self._times[position] = time
+        self._values[position] = value
+        self._sum += value
+        self._count += 1
+
+        # Recompute the sum once per lap so float error cannot accumulate
+        if self._count % self.capacity == 0:
+            self._sum = sum(self._values)
+
+        if self._ewma is None:
+            self._ewma = float(value)
+        else:
+            self._ewma += self.alpha * (value - self._ewma)
+
+        oldest = self._count - len(self)
+        sample = self._count - 1
+        values = self._values
+        capacity = self.capacity
+
+        queue = self._min
+        while queue and values[queue[-1] % capacity] >= value:
+            queue.pop()
+        queue.append(sample)
+        while queue[0] < oldest:
+            queue.popleft()
+
+        queue = self._max
+        while queue and values[queue[-1] % capacity] <= value:
+            queue.pop()
+        queue.append(sample)
+        while queue[0] < oldest:
+            queue.popleft()
+
+    def _value(self, sample):
+        return self._values[sample % self.capacity]
+
+    @property
+    def last_time(self):
+        if not self._count:
+            return None
+        return self._times[(self._count - 1) % self.capacity]
+
+    @property
+    def last(self):
+        if not self._count:
+            return None
+        return self._value(self._count - 1)
+
+    @property
+    def min(self):
+        return self._value(self._min[0]) if self._count else None
+
+    @property
+    def max(self):
+        return self._value(self._max[0]) if self._count else None
+
+    @property
+    def mean(self):
+        return self._sum / len(self) if self._count else None
+
+    @property
+    def ewma(self):
+        return self._ewma
+
+    def _time(self, index):
+        return self._times[(self._count - len(self) + index) % self.capacity]
+
+    def items(self, since=None, limit=None):
+        """
+        return [(time, value)] oldest first, only samples newer than since,
+        at most the limit most recent ones
+        """
+        size = len(self)
+        first = 0
+        if since is not None:
+            # Samples are appended in time order, bisect for the first newer one
+            low, high = 0, size
+            while low < high:
+                middle = (low + high) // 2
+                if self._time(middle) <= since:
+                    low = middle + 1
+                else:
+                    high = middle
+            first = low
+
+        if limit is not None:
+            first = max(first, size - limit)
+
+        start = self._count - size
+        return [(self._times[(start + i) % self.capacity],
+                 self._values[(start + i) % self.capacity])
+                for i in range(first, size)]
+
+    def dict(self):
+        return {
+            "count": len(self),
+            "last": self.last,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "ewma": self.ewma
+        }
+
+
+class History:
+    """
+    Ring buffers of recent readings, one per metric and per device metric
+
+    At most max_series buffers are kept, the one updated least recently is
+    dropped to make room for a new device, so memory stays bounded however
+    often devices come and go.
+    """
+
+    def __init__(self, capacity=3600, alpha=0.1, max_series=64):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.max_series = max_series
+        self._buffers = {}
+
+    def add(self, time, metric, value, device=None):
+        key = (device, metric)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            if len(self._buffers) >= self.max_series:
+                oldest = min(self._buffers,
+                             key=lambda k: self._buffers[k].last_time)
+                del self._buffers[oldest]
+
+            buffer = RingBuffer(self.capacity, self.alpha)
+            self._buffers[key] = buffer
+        buffer.append(time, value)
+
+    def get(self, metric, device=None):
+        return self._buffers.get((device, metric))
+
+    def dict(self, metric=None, device=None, since=None, limit=None):
+        """
+        Aggregates and samples of every buffer matching metric and device
+        (None matches all), samples filtered with since and limit
+        """
+        history = []
+        for (buffer_device, buffer_metric), buffer in sorted(
+                self._buffers.items(), key=lambda x: (x[0][0] or "", x[0][1])):
+            if metric is not None and metric != buffer_metric:
+                continue
+            if device is not None and device != buffer_device:
+                continue
+
+            history.append({
+                "device": buffer_device,
+                "metric": buffer_metric,
+                **buffer.dict(),
+                "items": buffer.items(since, limit)
+            })
+
+        return history
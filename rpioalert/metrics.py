@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import sys
+from bisect import bisect_left
+
+PROMETHEUS_TYPE = b"text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = b"application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Seconds, from a fast hidraw read up to a tty device hitting its timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels) + "}"
+
+
+def _value(value):
+    if value is None:
+        return "NaN"
+    return repr(float(value))
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, observe() is a bisection, two additions and a
+    comparison
+    """
+
+    __slots__ = ("buckets", "_counts", "count", "sum", "max")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket plus +Inf, not cumulative
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value):
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        """
+        return [(upper bound, count of observations <= bound)], last is +Inf
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self._counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q quantile, None when empty
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+    def lines(self, name, labels=()):
+        lines = []
+        for bound, total in self.cumulative():
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append("{}_bucket{} {}".format(name, _labels(list(labels) + [("le", le)]), total))
+        lines.append("{}_count{} {}".format(name, _labels(labels), self.count))
+        lines.append("{}_sum{} {}".format(name, _labels(labels), repr(self.sum)))
+        return lines
+
+
+class Metrics:
+    """
+    Exporter state, updated by rpio_alert once per tick
+
+    The exposition is rendered by render() at the end of a tick and kept as
+    bytes, in both the Prometheus text and the OpenMetrics format. A scrape
+    only writes the cached bytes, so any number of scrapers adds no work to
+    the poll loop.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.tick_latency = Histogram(buckets)
+        self.read_latency = Histogram(buckets)
+        self.tick_errors = 0
+        self.read_errors = {}
+        self._readings = []
+        self._stale = []
+        self._average = (None, None)
+        self._pins = []
+        self._zones = []
+        self.interval = None
+        self.missed_deadlines = 0
+        self.render()
+
+    def observe_read(self, seconds, status):
+        """
+        Record one read of every device, the Readings returned by get_status
+        """
+        self.read_latency.observe(seconds)
+
+        readings = []
+        self._stale = [(r.device, bool(r.stale)) for r in status if r.device is not None]
+        for r in status:
+            if r.error is not None:
+                self.read_errors[r.device] = self.read_errors.get(r.device, 0) + 1
+
+            product = r.info.get("product") if r.info else None
+            for metric, sensor, value in [
+                    ("temperature", "internal", r.internal_temperature),
+                    ("humidity", "internal", r.internal_humidity),
+                    ("temperature", "external", r.external_temperature),
+                    ("humidity", "external", r.external_humidity)]:
+                if value is not None:
+                    readings.append((metric, r.device, product, sensor, value))
+        self._readings = readings
+
+    def observe_tick(self, seconds, average=None, pins=None, error=False, zones=None):
+        self.tick_latency.observe(seconds)
+        if error:
+            self.tick_errors += 1
+        if average is not None:
+            self._average = average
+        if pins is not None:
+            self._pins = pins.state()
+        if zones is not None:
+            self._zones = [(zone.name, zone.temperature, zone.humidity) for zone in zones]
+
+    def observe_scheduler(self, scheduler):
+        self.interval = scheduler.current
+        self.missed_deadlines = scheduler.missed
+
+    def _families(self):
+        """
+        return [(name, type, help, [sample lines])]
+        """
+        celsius = [
+            "rpioalert_temperature_celsius{} {}".format(_labels([
+                ("device", device), ("product", product or ""), ("sensor", sensor)]), _value(value))
+            for metric, device, product, sensor, value in self._readings if metric == "temperature"]
+        percent = [
+            "rpioalert_humidity_percent{} {}".format(_labels([
+                ("device", device), ("product", product or ""), ("sensor", sensor)]), _value(value))
+            for metric, device, product, sensor, value in self._readings if metric == "humidity"]
+
+        return [
+            ("rpioalert_temperature_celsius", "gauge", "Temperature per device", celsius),
+            ("rpioalert_humidity_percent", "gauge", "Relative humidity per device", percent),
+            ("rpioalert_average_temperature_celsius", "gauge", "Average temperature of all devices",
+             ["rpioalert_average_temperature_celsius {}".format(_value(self._average[0]))]),
+            ("rpioalert_average_humidity_percent", "gauge", "Average relative humidity of all devices",
+             ["rpioalert_average_humidity_percent {}".format(_value(self._average[1]))]),
+            ("rpioalert_zone_temperature_celsius", "gauge", "Average temperature of the devices of a zone",
+             ["rpioalert_zone_temperature_celsius{} {}".format(_labels([("zone", name)]), _value(temperature))
+              for name, temperature, humidity in self._zones]),
+            ("rpioalert_zone_humidity_percent", "gauge", "Average relative humidity of the devices of a zone",
+             ["rpioalert_zone_humidity_percent{} {}".format(_labels([("zone", name)]), _value(humidity))
+              for name, temperature, humidity in self._zones]),
+            ("rpioalert_pin_state", "gauge", "GPIO pin state, 1 is on",
+             ["rpioalert_pin_state{} {}".format(_labels([("pin", p["pin"])]), int(p["state"]))
+              for p in self._pins]),
+            ("rpioalert_device_stale", "gauge", "1 while the last good reading of a failing device is reused",
+             ["rpioalert_device_stale{} {}".format(_labels([("device", device)]), int(stale))
+              for device, stale in self._stale]),
+            ("rpioalert_read_errors", "counter", "Failed reads per device",
+             ["rpioalert_read_errors_total{} {}".format(_labels([("device", device)]), count)
+              for device, count in sorted(self.read_errors.items())]),
+            ("rpioalert_tick_errors", "counter", "Ticks without a usable reading",
+             ["rpioalert_tick_errors_total {}".format(self.tick_errors)]),
+            ("rpioalert_poll_interval_seconds", "gauge", "Current poll interval",
+             ["rpioalert_poll_interval_seconds {}".format(_value(self.interval))]),
+            ("rpioalert_missed_deadlines", "counter", "Poll deadlines skipped because a tick ran late",
+             ["rpioalert_missed_deadlines_total {}".format(self.missed_deadlines)]),
+            ("rpioalert_read_duration_seconds", "histogram", "Time to read every device",
+             self.read_latency.lines("rpioalert_read_duration_seconds")),
+            ("rpioalert_tick_duration_seconds", "histogram", "Time of a whole poll tick",
+             self.tick_latency.lines("rpioalert_tick_duration_seconds"))
+        ]
+
+    def render(self):
+        prometheus = []
+        openmetrics = []
+        for name, kind, description, samples in self._families():
+            # Prometheus names the counter family after its sample
+            family = name + "_total" if kind == "counter" else name
+            prometheus.append("# HELP {} {}".format(family, description))
+            prometheus.append("# TYPE {} {}".format(family, kind))
+            prometheus.extend(samples)
+            openmetrics.append("# HELP {} {}".format(name, description))
+            openmetrics.append("# TYPE {} {}".format(name, kind))
+            openmetrics.extend(samples)
+        openmetrics.append("# EOF")
+
+        self.prometheus = ("\n".join(prometheus) + "\n").encode()
+        self.openmetrics = ("\n".join(openmetrics) + "\n").encode()
+
+
+class MetricsServer:
+    """
+    Minimal HTTP/1.1 server answering GET /metrics with the cached exposition
+    """
+
+    def __init__(self, metrics, max_connections=16, idle_timeout=60):
+        self.metrics = metrics
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._connections = 0
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    async def start(self, listen="0.0.0.0", port=9105):
+        return await asyncio.start_server(self._handle, listen, port)
+
+    def _response(self, status, content_type, body, keep_alive, head=False):
+        return b"".join([
+            b"HTTP/1.1 ", status, b"\r\n",
+            b"Content-Type: ", content_type, b"\r\n",
+            b"Content-Length: ", str(len(body)).encode(), b"\r\n",
+            b"Connection: ", b"keep-alive" if keep_alive else b"close", b"\r\n\r\n",
+            b"" if head else body])
+
+    async def _handle(self, reader, writer):
+        if self._connections >= self.max_connections:
+            writer.write(self._response(b"503 Service Unavailable", b"text/plain", b"", False))
+            writer.close()
+            return
+
+        self._connections += 1
+        try:
+            while True:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+                lines = request.decode("latin-1").split("\r\n")
+                parts = lines[0].split()
+                if len(parts) != 3:
+                    writer.write(self._response(b"400 Bad Request", b"text/plain", b"", False))
+                    break
+
+                method, path, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+
+                keep_alive = headers.get("connection") != "close" and version == "HTTP/1.1"
+
+                if method not in ["GET", "HEAD"]:
+                    writer.write(self._response(b"405 Method Not Allowed", b"text/plain", b"", keep_alive))
+                elif path.split("?")[0] != "/metrics":
+                    writer.write(self._response(b"404 Not Found", b"text/plain", b"", keep_alive))
+                elif "application/openmetrics-text" in headers.get("accept", ""):
+                    writer.write(self._response(b"200 OK", OPENMETRICS_TYPE, self.metrics.openmetrics,
+                                                keep_alive, method == "HEAD"))
+                else:
+                    writer.write(self._response(b"200 OK", PROMETHEUS_TYPE, self.metrics.prometheus,
+                                                keep_alive, method == "HEAD"))
+
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except:
+            self._logger.debug(sys.exc_info())
+        finally:
+            self._connections -= 1
+            try:
+                await writer.drain()
+            except:
+                pass
+            writer.close()
@@ -0,0 +1,102 @@
+import logging
+import sys
+
+
+class Pins:
+    """
+    In-memory model of the output pins
+
+    Keeps the desired and the applied state of every LED. A tick sets the
+    desired state, apply() then writes only the pins whose state actually
+    changes. Readers (RPC, LCD) use the cached applied state and never touch
+    the hardware.
+    """
+
+    def __init__(self, leds=[]):
+        self._leds = list(leds)
+        self.numbers = [led.pin.number for led in self._leds]
+        self._applied = [bool(led.is_lit) for led in self._leds]
+        self._desired = list(self._applied)
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def __len__(self):
+        return len(self._leds)
+
+    def set(self, state):
+        """
+        Set the desired state of every pin, applied on the next apply()
+        """
+        self._desired = [bool(state)] * len(self._leds)
+
+    def apply(self):
+        """
+        Write the pins whose desired state differs from the applied one
+        return [(pin, state)] of the pins changed
+        """
+        changes = []
+        for i, state in enumerate(self._desired):
+            if state == self._applied[i]:
+                continue
+
+            try:
+                if state:
+                    self._leds[i].on()
+                else:
+                    self._leds[i].off()
+            except:
+                self._logger.debug(sys.exc_info())
+                continue
+
+            self._applied[i] = state
+            changes.append((self.numbers[i], state))
+
+        return changes
+
+    def state(self):
+        return [{"pin": number, "state": state}
+                for number, state in zip(self.numbers, self._applied)]
+
+    def bitmap(self):
+        """
+        Applied state as an integer, bit n set if GPIO n is on
+        """
+        bitmap = 0
+        for number, state in zip(self.numbers, self._applied):
+            if state and number < 32:
+                bitmap |= 1 << number
+        return bitmap
+
+    def __str__(self):
+        return ", ".join("LED:{} {}".format(number, "ON" if state else "OFF")
+                         for number, state in zip(self.numbers, self._applied))
+
+    def close(self):
+        for led in self._leds:
+            if not led.closed:
+                led.off()
+                led.close()
+
+
+class PinGroup:
+    """
+    Read-only view of several Pins as one, e.g. the pins of every zone
+    """
+
+    def __init__(self, groups):
+        self.groups = list(groups)
+        self.numbers = [number for pins in self.groups for number in pins.numbers]
+
+    def __len__(self):
+        return sum(len(pins) for pins in self.groups)
+
+    def state(self):
+        return [state for pins in self.groups for state in pins.state()]
+
+    def bitmap(self):
+        bitmap = 0
+        for pins in self.groups:
+            bitmap |= pins.bitmap()
+        return bitmap
+
+    def __str__(self):
+        return ", ".join(str(pins) for pins in self.groups if len(pins))
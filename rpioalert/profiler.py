@@ -0,0 +1,105 @@
+import time
+
+from .metrics import Histogram
+
+# Seconds, from a condition evaluation up to a device read timing out
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Timer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.observe(self.name, time.perf_counter() - self.start)
+
+
+def _quantile(histogram, q):
+    # Bucket bound, never above the largest value seen (or +Inf)
+    return min(histogram.quantile(q), histogram.max)
+
+
+def _summary(histogram):
+    if not histogram.count:
+        return {"count": 0}
+    return {
+        "count": histogram.count,
+        "sum": histogram.sum,
+        "mean": histogram.sum / histogram.count,
+        "p50": _quantile(histogram, 0.5),
+        "p90": _quantile(histogram, 0.9),
+        "p99": _quantile(histogram, 0.99),
+        "max": histogram.max
+    }
+
+
+class Profiler:
+    """
+    Always-on timings of each stage of the poll loop and of rpc methods
+
+    Each stage is a fixed bucket Histogram, recording a timing costs two
+    perf_counter() calls and a bisection, so it stays enabled in production.
+    Quantiles are the upper bound of the bucket they fall in.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.started = time.time()
+        self.stages = {}
+        self.devices = {}
+        self.errors = {}
+
+    def observe(self, name, seconds):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages[name] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def stage(self, name):
+        """
+        with profiler.stage("toggle"): ... records the time spent in the block
+        """
+        return _Timer(self, name)
+
+    def observe_device(self, device, seconds, error=False):
+        histogram = self.devices.get(device)
+        if histogram is None:
+            histogram = self.devices[device] = Histogram(self.buckets)
+            self.errors[device] = 0
+        histogram.observe(seconds)
+        if error:
+            self.errors[device] += 1
+
+    def dict(self):
+        return {
+            "stages": {name: _summary(h) for name, h in sorted(self.stages.items())},
+            "devices": {device: {**_summary(h), "errors": self.errors[device]}
+                        for device, h in sorted(self.devices.items())},
+            "uptime": time.time() - self.started
+        }
+
+    def summary(self):
+        """
+        return the timings as a text table, in milliseconds
+        """
+        lines = ["{:<24} {:>8} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+            "stage", "count", "mean", "p50", "p99", "max", "errors")]
+
+        rows = [(name, h, "") for name, h in sorted(self.stages.items())]
+        rows += [("device " + device, h, self.errors[device])
+                 for device, h in sorted(self.devices.items())]
+        for name, h, errors in rows:
+            if not h.count:
+                continue
+            lines.append("{:<24} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>6}".format(
+                name, h.count, 1000 * h.sum / h.count, 1000 * _quantile(h, 0.5),
+                1000 * _quantile(h, 0.99), 1000 * h.max, errors))
+        return "\n".join(lines)
@@ -0,0 +1,266 @@
+import asyncio
+import codecs
+import json
+import logging
+import sys
+import time
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+SERVER_BUSY = -32000
+
+
+class RawJSON:
+    """
+    Result encoded to JSON once, written as is to every client asking for it
+    """
+
+    __slots__ = ("data", "json")
+
+    def __init__(self, data):
+        self.data = data
+        self.json = json.dumps(data).encode()
+
+
+class Stream:
+    """
+    Method result that keeps sending notifications after the response
+
+    The response carries result, then every message returned by next()
+    (an encoded notification line) is written to the connection until the
+    client disconnects, close() is called then.
+    """
+
+    result = None
+
+    async def next(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class RpcServer:
+    """
+    JSON-RPC 2.0 server over plain TCP
+
+    Requests are JSON values sent back to back, usually one per line. A
+    connection stays open and may pipeline requests or send batches,
+    responses are written one per line in request order.
+
+    A request without "jsonrpc" is answered the way the old single-shot
+    protocol did, with the bare result and the connection closed, so
+    existing get_status clients keep working.
+    """
+
+    def __init__(self, max_connections=16, max_request_size=65536, idle_timeout=300, profiler=None):
+        self.max_connections = max_connections
+        self.max_request_size = max_request_size
+        self.idle_timeout = idle_timeout
+        self.profiler = profiler
+        self._methods = {}
+        self._connections = 0
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def register(self, method, handler):
+        """
+        handler is a coroutine function called with the params dict (or list)
+        returning a JSON serializable result, or a RawJSON already encoded
+        """
+        self._methods[method] = handler
+
+    async def start(self, listen="0.0.0.0", port=15555):
+        return await asyncio.start_server(self._handle, listen, port)
+
+    def _encode_response(self, response):
+        result = response.get("result")
+        if isinstance(result, Stream):
+            response = dict(response, result=result.result)
+            result = result.result
+        if isinstance(result, RawJSON):
+            return b"".join([b'{"jsonrpc": "2.0", "result": ', result.json,
+                             b', "id": ', json.dumps(response["id"]).encode(), b"}"])
+        return json.dumps(response).encode()
+
+    def _encode(self, response):
+        if isinstance(response, list):
+            return b"[" + b", ".join(self._encode_response(r) for r in response) + b"]\n"
+        return self._encode_response(response) + b"\n"
+
+    def _error(self, code, message, request_id=None):
+        return {"jsonrpc": "2.0", "error": {"code": code, "message": message}, "id": request_id}
+
+    async def _call(self, request):
+        """
+        Run one request object, return (response, legacy)
+        response is None for notifications
+        """
+        if not isinstance(request, dict):
+            return self._error(INVALID_REQUEST, "Invalid request"), False
+
+        legacy = "jsonrpc" not in request
+        request_id = request.get("id")
+
+        try:
+            if not legacy and request["jsonrpc"] != "2.0":
+                raise RpcError(INVALID_REQUEST, "Invalid request")
+
+            method = request.get("method")
+            if method not in self._methods:
+                raise RpcError(METHOD_NOT_FOUND, "Method not found")
+
+            params = request.get("params")
+            if params is None:
+                params = {}
+            if not isinstance(params, (dict, list)):
+                raise RpcError(INVALID_PARAMS, "Invalid params")
+
+            start = time.perf_counter()
+            try:
+                result = await self._methods[method](params)
+            finally:
+                if self.profiler is not None:
+                    self.profiler.observe("rpc." + method, time.perf_counter() - start)
+        except asyncio.CancelledError:
+            raise
+        except RpcError as e:
+            if legacy:
+                return None, True
+            return self._error(e.code, e.message, request_id), False
+        except:
+            self._logger.debug(sys.exc_info())
+            if legacy:
+                return None, True
+            return self._error(INTERNAL_ERROR, "Internal error", request_id), False
+
+        if legacy:
+            return result, True
+        if "id" not in request:
+            if isinstance(result, Stream):
+                result.close()
+            return None, False
+        return {"jsonrpc": "2.0", "result": result, "id": request_id}, False
+
+    async def _dispatch(self, request):
+        """
+        return (response, legacy) for a request or a batch
+        """
+        if isinstance(request, list):
+            if not request:
+                return self._error(INVALID_REQUEST, "Invalid request"), False
+
+            responses = []
+            for r in request:
+                response, legacy = await self._call(r)
+                if legacy:
+                    response = self._error(INVALID_REQUEST, "Invalid request")
+                if response is not None:
+                    responses.append(response)
+            return (responses or None), False
+
+        return await self._call(request)
+
+    def _streams(self, response):
+        responses = response if isinstance(response, list) else [response]
+        return [r["result"] for r in responses
+                if isinstance(r.get("result"), Stream)]
+
+    async def _pump(self, stream, writer):
+        try:
+            while True:
+                writer.write(await stream.next())
+                await writer.drain()
+        except asyncio.CancelledError:
+            raise
+        except:
+            self._logger.debug(sys.exc_info())
+
+    async def _handle(self, reader, writer):
+        if self._connections >= self.max_connections:
+            writer.write(self._encode(self._error(SERVER_BUSY, "Too many connections")))
+            writer.close()
+            return
+
+        self._connections += 1
+        decoder = json.JSONDecoder()
+        text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        pumps = {}
+
+        try:
+            while True:
+                # A connection streaming notifications is not idle
+                timeout = None if pumps else self.idle_timeout
+                data = await asyncio.wait_for(reader.read(4096), timeout)
+                if not data:
+                    break
+                buffer += text.decode(data)
+
+                while True:
+                    buffer = buffer.lstrip()
+                    if not buffer:
+                        break
+
+                    try:
+                        request, end = decoder.raw_decode(buffer)
+                    except json.JSONDecodeError as e:
+                        # Error at the end of the data, the request is still
+                        # arriving, otherwise skip the rest of the bad line
+                        if e.pos >= len(buffer) or e.msg.startswith("Unterminated string"):
+                            if len(buffer) > self.max_request_size:
+                                writer.write(self._encode(self._error(PARSE_ERROR, "Request too large")))
+                                return
+                            break
+
+                        writer.write(self._encode(self._error(PARSE_ERROR, "Parse error")))
+                        newline = buffer.find("\n", e.pos)
+                        buffer = "" if newline < 0 else buffer[newline + 1:]
+                        continue
+
+                    buffer = buffer[end:]
+                    self._logger.debug("Request : {}".format(request))
+
+                    response, legacy = await self._dispatch(request)
+                    self._logger.debug("Response : {}".format(response))
+
+                    if legacy:
+                        if isinstance(response, Stream):
+                            response.close()
+                        elif isinstance(response, RawJSON):
+                            writer.write(response.json)
+                        elif response is not None:
+                            writer.write(json.dumps(response).encode())
+                        return
+
+                    if response is not None:
+                        writer.write(self._encode(response))
+                        for stream in self._streams(response):
+                            pumps[stream] = asyncio.ensure_future(self._pump(stream, writer))
+
+                await writer.drain()
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except:
+            self._logger.debug(sys.exc_info())
+        finally:
+            for stream, pump in pumps.items():
+                pump.cancel()
+                stream.close()
+            self._connections -= 1
+            try:
+                await writer.drain()
+            except:
+                pass
+            writer.close()
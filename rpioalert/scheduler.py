@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+
+class Scheduler:
+    """
+    Fixed-rate poll scheduler
+
+    Ticks start on a grid of deadlines interval seconds apart, counted from
+    the previous deadline rather than from the end of the tick, so the time
+    spent reading and writing does not make the period drift. A tick running
+    past one or more deadlines does not queue catch-up ticks, the deadlines
+    are skipped and counted in missed.
+
+    With min_interval or max_interval different from interval the rate
+    adapts to the readings: polling at min_interval while the temperature or
+    humidity is within margin of a condition threshold, back to interval when
+    a reading moved by more than margin since the last tick, and slowing down
+    up to max_interval while readings are stable and far from any threshold.
+    """
+
+    def __init__(self, interval=1.0, min_interval=None, max_interval=None, margin=1.0, thresholds=[]):
+        self.missed = 0
+        self._deadline = time.monotonic()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.configure(interval, min_interval, max_interval, margin, thresholds)
+
+    def configure(self, interval=1.0, min_interval=None, max_interval=None, margin=1.0, thresholds=[]):
+        """
+        Set the intervals and thresholds, keeps the deadline grid and the
+        missed count, the next deadline uses the new interval
+        """
+        self.interval = interval
+        self.min_interval = interval if min_interval is None else min(min_interval, interval)
+        self.max_interval = interval if max_interval is None else max(max_interval, interval)
+        self.margin = margin
+        self.thresholds = list(thresholds)
+        self.current = interval
+        self._last = None
+
+    def start(self):
+        """
+        Start the deadline grid now, call before the first tick
+        """
+        self._deadline = time.monotonic()
+
+    @property
+    def adaptive(self):
+        return self.min_interval < self.interval or self.max_interval > self.interval
+
+    def distance(self, temperature, humidity, thresholds=None):
+        """
+        return the distance of the values to the nearest threshold, of
+        thresholds or of the scheduler
+        """
+        values = {"temperature": temperature, "humidity": humidity}
+        return min([abs(values[metric] - value) for metric, value in
+                    (self.thresholds if thresholds is None else thresholds)],
+                   default=float("inf"))
+
+    def adapt(self, temperature, humidity, distance=None):
+        """
+        Pick the interval to the next tick from the latest averages, and
+        the distance to the nearest threshold when computed by the caller
+        return the new interval
+        """
+        if not self.adaptive:
+            return self.current
+
+        values = {"temperature": temperature, "humidity": humidity}
+        if distance is None:
+            distance = self.distance(temperature, humidity)
+        moved = self._last is not None and any(
+            abs(values[metric] - self._last[metric]) > self.margin for metric in values)
+        self._last = values
+
+        if distance <= self.margin:
+            current = self.min_interval
+        elif moved:
+            current = self.interval
+        else:
+            current = min(self.max_interval, self.current * 2)
+
+        if current != self.current:
+            self._logger.debug("Interval {} -> {}, T:{}, H:{}, distance:{}".format(
+                self.current, current, temperature, humidity, distance))
+            self.current = current
+        return current
+
+    def delay(self):
+        """
+        Move to the next deadline, skipping the ones already past
+        return seconds until it
+        """
+        now = time.monotonic()
+        self._deadline += self.current
+        if self._deadline < now:
+            missed = int((now - self._deadline) // self.current) + 1
+            self.missed += missed
+            self._deadline += missed * self.current
+            self._logger.debug("Missed {} deadline(s)".format(missed))
+        return self._deadline - now
+
+    async def sleep(self):
+        await asyncio.sleep(self.delay())
@@ -0,0 +1,256 @@
+import math
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+NAME = "rpioalert"
+MAGIC = b"RPIOSHM1"
+
+# magic, max devices, max pins, sequence, publish time, average temperature
+# and humidity, device count, pin count
+HEADER = struct.Struct("<8sIIQdddII")
+HEADER_SIZE = 64
+SEQUENCE_OFFSET = 16
+# pid of the daemon owning the segment, after the header
+OWNER = struct.Struct("<I")
+OWNER_OFFSET = HEADER.size
+# device id, usb port, busnum, devnum, vendorid, productid, firmware, reading
+# time, internal and external temperature and humidity, flags, error
+DEVICE = struct.Struct("<8s16sHHHH16sdddddB7x48s")
+# pin number, state
+PIN = struct.Struct("<BB")
+
+STALE = 1
+
+
+class ShmError(Exception):
+    pass
+
+
+def _size(max_devices, max_pins):
+    return HEADER_SIZE + max_devices * DEVICE.size + max_pins * PIN.size
+
+
+def _text(value, size):
+    if isinstance(value, bytes):
+        return value[:size]
+    return (value or "").encode("utf-8", "replace")[:size]
+
+
+def _float(value):
+    return math.nan if value is None else value
+
+
+def _alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Broker:
+    """
+    Publishes the latest readings and pin states of the daemon in a shared
+    memory segment, for local processes to read without opening a device
+
+    Writes are guarded by a seqlock: the sequence number in the header is
+    odd while the segment is being written, and incremented again when
+    done. A reader copies the segment and retries when the sequence was odd
+    or changed meanwhile, neither side ever waits on the other.
+    """
+
+    def __init__(self, name=NAME, max_devices=32, max_pins=32):
+        self.name = name
+        self.max_devices = max_devices
+        self.max_pins = max_pins
+        size = _size(max_devices, max_pins)
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self._take_over(name)
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+
+        self._buffer = self._shm.buf
+        self._sequence = 0
+        HEADER.pack_into(self._buffer, 0, MAGIC, max_devices, max_pins, 0, 0.0,
+                         math.nan, math.nan, 0, 0)
+        OWNER.pack_into(self._buffer, OWNER_OFFSET, os.getpid())
+
+    @staticmethod
+    def _take_over(name):
+        """
+        Remove a segment left by a daemon that did not stop cleanly, raise
+        ShmError when it belongs to a running process or is not ours
+        """
+        stale = shared_memory.SharedMemory(name)
+        pid = None
+        try:
+            if bytes(stale.buf[:len(MAGIC)]) != MAGIC:
+                raise ShmError("Shared memory '{}' exists and is not an rpioalert segment".format(name))
+            pid = OWNER.unpack_from(stale.buf, OWNER_OFFSET)[0]
+            if _alive(pid):
+                raise ShmError("Shared memory '{}' is in use by process {}, "
+                               "is another rpioalert running with --shm?".format(name, pid))
+        except ShmError:
+            # Attaching tracks the segment, which would remove it when this
+            # process exits, unless this process already owns it
+            if pid != os.getpid():
+                resource_tracker.unregister(stale._name, "shared_memory")
+            raise
+        finally:
+            stale.close()
+        stale.unlink()
+
+    def publish(self, readings, pins=None, average=(None, None), now=None):
+        """
+        Write the Readings of every device, the pin states [{"pin", "state"}]
+        and the (temperature, humidity) average
+        """
+        readings = readings[:self.max_devices]
+        pins = (pins or [])[:self.max_pins]
+        buffer = self._buffer
+
+        self._sequence += 1
+        struct.pack_into("<Q", buffer, SEQUENCE_OFFSET, self._sequence)
+
+        offset = HEADER_SIZE
+        for r in readings:
+            info = r.info or {}
+            DEVICE.pack_into(
+                buffer, offset, _text(r.device, 8), _text(info.get("port"), 16),
+                info.get("busnum", 0), info.get("devnum", 0),
+                info.get("vendorid", 0), info.get("productid", 0),
+                _text(r.firmware, 16), r.time,
+                _float(r.internal_temperature), _float(r.internal_humidity),
+                _float(r.external_temperature), _float(r.external_humidity),
+                STALE if r.stale else 0, _text(r.error, 48))
+            offset += DEVICE.size
+
+        offset = HEADER_SIZE + self.max_devices * DEVICE.size
+        for pin in pins:
+            PIN.pack_into(buffer, offset, pin["pin"], bool(pin["state"]))
+            offset += PIN.size
+
+        HEADER.pack_into(buffer, 0, MAGIC, self.max_devices, self.max_pins, self._sequence,
+                         time.time() if now is None else now,
+                         _float(average[0]), _float(average[1]), len(readings), len(pins))
+        self._sequence += 1
+        struct.pack_into("<Q", buffer, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self):
+        self._buffer = None
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class Reader:
+    """
+    Reads what a Broker published, from any local process
+    """
+
+    def __init__(self, name=NAME):
+        try:
+            try:
+                self._shm = shared_memory.SharedMemory(name, track=False)
+            except TypeError:
+                self._shm = shared_memory.SharedMemory(name)
+                # Before Python 3.13 the segment is tracked, and removed
+                # when this process exits, only the daemon may remove it
+                resource_tracker.unregister(self._shm._name, "shared_memory")
+        except FileNotFoundError:
+            raise ShmError("No rpioalert shared memory '{}', is the daemon running with --shm?".format(name))
+
+        magic, self.max_devices, self.max_pins = struct.unpack_from("<8sII", self._shm.buf, 0)
+        if magic != MAGIC:
+            self._shm.close()
+            raise ShmError("Invalid rpioalert shared memory '{}'".format(name))
+        self._size = _size(self.max_devices, self.max_pins)
+
+    def _copy(self, retries):
+        buffer = self._shm.buf
+        for _ in range(retries):
+            sequence = struct.unpack_from("<Q", buffer, SEQUENCE_OFFSET)[0]
+            if sequence & 1:
+                time.sleep(0)
+                continue
+            data = bytes(buffer[:self._size])
+            if struct.unpack_from("<Q", buffer, SEQUENCE_OFFSET)[0] == sequence:
+                return data
+        raise ShmError("Shared memory kept changing while reading")
+
+    def read(self, retries=1000):
+        """
+        return the latest state, shaped as get_status:
+        {"sequence", "time", "status": {"temperature", "humidity"},
+         "devices": [reading as Reading.dict()], "led": [{"pin", "state"}]}
+        time is 0 before the first publish
+        """
+        data = self._copy(retries)
+        (_, _, _, sequence, published, temperature, humidity,
+         device_count, pin_count) = HEADER.unpack_from(data, 0)
+
+        devices = []
+        for i in range(device_count):
+            (device, port, busnum, devnum, vendorid, productid, firmware, reading_time,
+             internal_temperature, internal_humidity, external_temperature, external_humidity,
+             flags, error) = DEVICE.unpack_from(data, HEADER_SIZE + i * DEVICE.size)
+            reading = {
+                "device": device.rstrip(b"\0").decode("utf-8", "replace"),
+                "port": port.rstrip(b"\0").decode("utf-8", "replace"),
+                "busnum": busnum,
+                "devnum": devnum,
+                "vendorid": vendorid,
+                "productid": productid,
+                "time": reading_time
+            }
+            for key, value in [("firmware", firmware), ("error", error)]:
+                value = value.rstrip(b"\0").decode("utf-8", "replace")
+                if value:
+                    reading[key] = value
+            for key, value in [("internal temperature", internal_temperature),
+                               ("internal humidity", internal_humidity),
+                               ("external temperature", external_temperature),
+                               ("external humidity", external_humidity)]:
+                if not math.isnan(value):
+                    reading[key] = value
+            if flags & STALE:
+                reading["stale"] = True
+            devices.append(reading)
+
+        offset = HEADER_SIZE + self.max_devices * DEVICE.size
+        led = [{"pin": number, "state": bool(state)} for number, state in
+               PIN.iter_unpack(data[offset:offset + pin_count * PIN.size])]
+
+        return {
+            "sequence": sequence,
+            "time": published,
+            "status": {
+                "temperature": None if math.isnan(temperature) else temperature,
+                "humidity": None if math.isnan(humidity) else humidity
+            },
+            "devices": devices,
+            "led": led
+        }
+
+    def close(self):
+        self._shm.close()
+
+
+def read(name=NAME):
+    """
+    return the latest state published by the daemon, see Reader.read
+    """
+    reader = Reader(name)
+    try:
+        return reader.read()
+    finally:
+        reader.close()
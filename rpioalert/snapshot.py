@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import deque
+
+from .rpc import RawJSON, Stream
+
+# Bound of the pending notifications a client may ask for
+MAX_QUEUE_SIZE = 64
+
+
+class Snapshot(RawJSON):
+    """
+    Immutable state published once per tick, JSON encoded on creation
+    """
+
+    __slots__ = ()
+
+    def __init__(self, stats, pins, off_condition, on_condition, off_first=False, zones=None, devices=None):
+        data = {
+            "status": stats.dict(),
+            "condition": {
+                "off": list(off_condition.conditions),
+                "on": list(on_condition.conditions),
+                "off_first": off_first
+            },
+            "led": pins.state(),
+            "time": str(int(time.time()))
+        }
+        if zones is not None:
+            data["zones"] = [zone.dict() for zone in zones]
+        if devices is not None:
+            data["devices"] = devices
+        super().__init__(data)
+
+
+def _moved(current, last, deadband):
+    # None while no device has a record
+    if current is None or last is None:
+        return (current is None) != (last is None)
+    return abs(current - last) > deadband
+
+
+def _health(data):
+    return [(device["device"], device["state"], device["stale"], device["excluded"])
+            for device in data.get("devices", [])]
+
+
+class Subscription(Stream):
+    """
+    Status change notifications for one client
+
+    A snapshot is queued when a reading moved by more than its deadband
+    since the last queued one, or when any pin or device health changed. The queue is
+    bounded, when a client does not keep up the oldest notification is
+    dropped, so the latest state is always delivered and publishing never
+    waits for a client.
+    """
+
+    def __init__(self, publisher, temperature_deadband=0.1, humidity_deadband=0.5, queue_size=16):
+        self.publisher = publisher
+        self.temperature_deadband = temperature_deadband
+        self.humidity_deadband = humidity_deadband
+        self.queue_size = min(MAX_QUEUE_SIZE, max(1, queue_size))
+        self.dropped = 0
+        self.result = {
+            "subscribed": True,
+            "temperature_deadband": temperature_deadband,
+            "humidity_deadband": humidity_deadband,
+            "queue_size": self.queue_size
+        }
+        self._last = None
+        self._queue = deque()
+        self._ready = asyncio.Event()
+
+    def _changed(self, snapshot):
+        if self._last is None:
+            return True
+
+        last = self._last.data
+        current = snapshot.data
+        if current["led"] != last["led"]:
+            return True
+        if _moved(current["status"]["temperature"], last["status"]["temperature"], self.temperature_deadband):
+            return True
+        if _moved(current["status"]["humidity"], last["status"]["humidity"], self.humidity_deadband):
+            return True
+        if _health(current) != _health(last):
+            return True
+        return False
+
+    def offer(self, snapshot, message):
+        if not self._changed(snapshot):
+            return
+
+        self._last = snapshot
+        if len(self._queue) >= self.queue_size:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(message)
+        self._ready.set()
+
+    async def next(self):
+        while not self._queue:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+    def close(self):
+        self.publisher.unsubscribe(self)
+
+
+class Publisher:
+    """
+    Holds the latest Snapshot, readers take it without any lock, and hands
+    it to every subscription
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self._subscriptions = set()
+
+    def subscribe(self, **kwargs):
+        subscription = Subscription(self, **kwargs)
+        self._subscriptions.add(subscription)
+        if self.snapshot is not None:
+            subscription.offer(self.snapshot, self._message(self.snapshot))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+
+    def _message(self, snapshot):
+        return b'{"jsonrpc": "2.0", "method": "status", "params": ' + snapshot.json + b"}\n"
+
+    def publish(self, snapshot):
+        self.snapshot = snapshot
+        if not self._subscriptions:
+            return
+
+        # Encoded once, shared by every subscription
+        message = self._message(snapshot)
+        for subscription in list(self._subscriptions):
+            subscription.offer(snapshot, message)
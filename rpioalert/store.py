@@ -0,0 +1,402 @@
+import argparse
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+
+# Fixed width record: time, device, temperature, humidity, pin bitmap
+RECORD = struct.Struct("<d8sffI4x")
+# Segment header: magic, resolution in seconds (0 is raw), capacity, count
+HEADER = struct.Struct("<8sIII")
+HEADER_SIZE = 64
+MAGIC = b"RPIOSEG1"
+
+# Rollup levels, oldest data ends up in the coarsest one
+RAW = 0
+MINUTE = 60
+HOUR = 3600
+LEVELS = {RAW: "raw", MINUTE: "minute", HOUR: "hour"}
+
+
+class Record:
+    __slots__ = ("time", "device", "temperature", "humidity", "pins", "resolution")
+
+    def __init__(self, time, device, temperature, humidity, pins=0, resolution=RAW):
+        self.time = time
+        self.device = device
+        self.temperature = temperature
+        self.humidity = humidity
+        self.pins = pins
+        self.resolution = resolution
+
+    def pack(self):
+        return RECORD.pack(
+            self.time, self.device.encode("ascii")[:8],
+            math.nan if self.temperature is None else self.temperature,
+            math.nan if self.humidity is None else self.humidity,
+            self.pins)
+
+    @classmethod
+    def unpack_from(cls, buffer, offset, resolution=RAW):
+        timestamp, device, temperature, humidity, pins = RECORD.unpack_from(buffer, offset)
+        return cls(timestamp, device.rstrip(b"\0").decode("ascii"),
+                   None if math.isnan(temperature) else temperature,
+                   None if math.isnan(humidity) else humidity,
+                   pins, resolution)
+
+    def dict(self):
+        return {
+            "time": self.time,
+            "device": self.device or None,
+            "temperature": self.temperature,
+            "humidity": self.humidity,
+            "pins": self.pins,
+            "resolution": self.resolution
+        }
+
+
+class Segment:
+    """
+    Preallocated, memory-mapped file of fixed width records in time order
+
+    The record count lives in the header, written after each record, so a
+    reader never sees a partial record.
+    """
+
+    def __init__(self, path, capacity=None, resolution=RAW, writable=False):
+        self.path = path
+        self.start = int(os.path.basename(path).split(".")[0])
+
+        if capacity is not None and not os.path.exists(path):
+            size = HEADER_SIZE + capacity * RECORD.size
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd, 0, size)
+                else:
+                    os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(MAGIC, resolution, capacity, 0), 0)
+            finally:
+                os.close(fd)
+
+        with open(path, "r+b" if writable else "rb") as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0,
+                                 access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+        magic, self.resolution, self.capacity, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError("Not a segment file {}".format(path))
+
+    @property
+    def count(self):
+        return HEADER.unpack_from(self._mm, 0)[3]
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, record):
+        count = self.count
+        self._mm[HEADER_SIZE + count * RECORD.size:
+                 HEADER_SIZE + (count + 1) * RECORD.size] = record.pack()
+        HEADER.pack_into(self._mm, 0, MAGIC, self.resolution, self.capacity, count + 1)
+
+    def _time(self, index):
+        return struct.unpack_from("<d", self._mm, HEADER_SIZE + index * RECORD.size)[0]
+
+    def bisect(self, timestamp, count=None):
+        """
+        return the index of the first record at or after timestamp
+        """
+        low, high = 0, self.count if count is None else count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, since=None, until=None):
+        count = self.count
+        first = 0 if since is None else self.bisect(since, count)
+        last = count if until is None else self.bisect(until, count)
+        for i in range(first, last):
+            yield Record.unpack_from(self._mm, HEADER_SIZE + i * RECORD.size, self.resolution)
+
+    @property
+    def last_time(self):
+        count = self.count
+        return self._time(count - 1) if count else None
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.close()
+
+
+def rollup(records, resolution):
+    """
+    Average records per device into resolution wide buckets, pin bitmaps are
+    OR-ed so a pin that was on at any time in the bucket shows as on
+    """
+    buckets = {}
+    for record in records:
+        key = (int(record.time // resolution) * resolution, record.device)
+        bucket = buckets.setdefault(key, [0.0, 0, 0.0, 0, 0])
+        if record.temperature is not None:
+            bucket[0] += record.temperature
+            bucket[1] += 1
+        if record.humidity is not None:
+            bucket[2] += record.humidity
+            bucket[3] += 1
+        bucket[4] |= record.pins
+
+    return [Record(float(start), device,
+                   bucket[0] / bucket[1] if bucket[1] else None,
+                   bucket[2] / bucket[3] if bucket[3] else None,
+                   bucket[4], resolution)
+            for (start, device), bucket in sorted(buckets.items())]
+
+
+class Store:
+    """
+    Persistent, SD card friendly log of readings
+
+    Records are appended to preallocated memory-mapped segment files and
+    only flushed to disk every flush_interval seconds. When more than
+    keep[level] full segments exist at a level, the oldest one is rolled up
+    into minute (from raw) or hour (from minute) averages and removed, hour
+    segments beyond their limit are deleted. Starting a segment only sets
+    pending, compact() does the rollup. A Store is not thread safe, the
+    daemon makes every call from its own store thread.
+
+    A readonly store only queries, it creates nothing and raises
+    FileNotFoundError when the directory is missing.
+    """
+
+    def __init__(self, directory, capacity=65536, flush_interval=60, keep={RAW: 4, MINUTE: 8, HOUR: 16}, readonly=False):
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.keep = keep
+        self.readonly = readonly
+        self.pending = False
+        self._active = {}
+        self._last_flush = time.monotonic()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+        if readonly:
+            if not os.path.isdir(directory):
+                raise FileNotFoundError("No store directory {}".format(directory))
+            return
+        for level in LEVELS.values():
+            os.makedirs(os.path.join(directory, level), exist_ok=True)
+
+    def _paths(self, resolution):
+        directory = os.path.join(self.directory, LEVELS[resolution])
+        if self.readonly and not os.path.isdir(directory):
+            return []
+        names = [name for name in os.listdir(directory) if name.endswith(".seg")]
+        return [os.path.join(directory, name)
+                for name in sorted(names, key=lambda name: int(name.split(".")[0]))]
+
+    def _segment(self, resolution, timestamp):
+        """
+        return the writable segment of a level, starting a new one when full
+        """
+        segment = self._active.get(resolution)
+        if segment is not None and not segment.full:
+            return segment
+
+        if segment is not None:
+            segment.flush()
+            segment.close()
+        else:
+            paths = self._paths(resolution)
+            if paths:
+                segment = Segment(paths[-1], writable=True)
+                if not segment.full:
+                    self._active[resolution] = segment
+                    return segment
+                segment.close()
+
+        path = os.path.join(self.directory, LEVELS[resolution], "{}.seg".format(int(timestamp)))
+        while os.path.exists(path):
+            timestamp += 1
+            path = os.path.join(self.directory, LEVELS[resolution], "{}.seg".format(int(timestamp)))
+
+        segment = Segment(path, self.capacity, resolution, writable=True)
+        self._active[resolution] = segment
+        self.pending = True
+        return segment
+
+    def _last_time(self, resolution):
+        segment = self._active.get(resolution)
+        if segment is None:
+            paths = self._paths(resolution)
+            if not paths:
+                return None
+            segment = Segment(paths[-1])
+            try:
+                return segment.last_time
+            finally:
+                segment.close()
+        return segment.last_time
+
+    def _compact(self, resolution):
+        """
+        roll up full segments beyond the number kept at this level
+
+        Only whole buckets are rolled up: the bucket at the end of a segment
+        takes the records of the following segments up to its end, and the
+        buckets already in the coarser level are left out, so a bucket split
+        across segments is written once. A segment whose last bucket is not
+        complete yet, no later record at this level, is left for a later
+        compaction.
+        """
+        paths = self._paths(resolution)
+        # The newest segment is the active one
+        count = max(0, len(paths) - 1 - self.keep.get(resolution, 0))
+        for i, path in enumerate(paths[:count]):
+            try:
+                if resolution == RAW or resolution == MINUTE:
+                    coarser = MINUTE if resolution == RAW else HOUR
+                    segment = Segment(path)
+                    records = list(segment.records())
+                    segment.close()
+                    if records:
+                        end = (records[-1].time // coarser + 1) * coarser
+                        complete = False
+                        for later in paths[i + 1:]:
+                            segment = Segment(later)
+                            records.extend(segment.records(until=end))
+                            complete = segment.last_time is not None and segment.last_time >= end
+                            segment.close()
+                            if complete:
+                                break
+                        if not complete:
+                            return
+
+                    done = self._last_time(coarser)
+                    for record in rollup(records, coarser):
+                        if done is None or record.time > done:
+                            self._append(coarser, record)
+                os.remove(path)
+            except:
+                self._logger.debug(sys.exc_info())
+
+    def compact(self):
+        """
+        roll up and remove the segments beyond keep, the slow part of
+        appending, run it off the event loop when pending
+        """
+        self.pending = False
+        for resolution in [RAW, MINUTE, HOUR]:
+            self._compact(resolution)
+
+    def _append(self, resolution, record):
+        self._segment(resolution, record.time).append(record)
+
+    def append(self, records):
+        for record in records:
+            self._append(RAW, record)
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        for segment in self._active.values():
+            segment.flush()
+        self._last_flush = time.monotonic()
+
+    def query(self, since=None, until=None, device=None, limit=None):
+        """
+        return the records with since <= time < until, oldest first, at most
+        the limit most recent ones. Older ranges come from the rolled up
+        levels, each segment is searched with bisection. A finer level only
+        adds the records after the last bucket read from the coarser ones,
+        so a rolled up range is not returned twice
+        """
+        records = []
+        covered = since
+        for resolution in [HOUR, MINUTE, RAW]:
+            count = len(records)
+            paths = self._paths(resolution)
+            for i, path in enumerate(paths):
+                # A segment holds records up to the start of the next one
+                if until is not None and int(os.path.basename(path).split(".")[0]) >= until:
+                    break
+                if covered is not None and i + 1 < len(paths) and \
+                        int(os.path.basename(paths[i + 1]).split(".")[0]) <= covered:
+                    continue
+
+                active = self._active.get(resolution)
+                if active is not None and active.path == path:
+                    segment = active
+                else:
+                    segment = Segment(path)
+
+                try:
+                    for record in segment.records(covered, until):
+                        if device is not None and record.device != device:
+                            continue
+                        records.append(record)
+                finally:
+                    if segment is not active:
+                        segment.close()
+
+            if len(records) > count and resolution != RAW:
+                end = records[-1].time + resolution
+                covered = end if covered is None else max(covered, end)
+
+        if limit is not None:
+            records = records[-limit:]
+        return records
+
+    def close(self):
+        for segment in self._active.values():
+            segment.flush()
+            segment.close()
+        self._active.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the rpioalert reading log")
+    parser.add_argument("directory", help="Store directory, as given to rpioalert --store")
+    parser.add_argument("--since", help="Start time, unix timestamp", type=float, default=None)
+    parser.add_argument("--until", help="End time, unix timestamp", type=float, default=None)
+    parser.add_argument("--device", help="Device, e.g. 001/004, empty for the average", type=str, default=None)
+    parser.add_argument("--limit", help="Most recent records only", type=int, default=None)
+    parser.add_argument("--json", help="Output as JSON", action="store_true", default=False)
+    args = parser.parse_args()
+
+    try:
+        store = Store(args.directory, readonly=True)
+    except FileNotFoundError as e:
+        print(e)
+        return 1
+    records = store.query(args.since, args.until, args.device, args.limit)
+
+    if args.json:
+        print(json.dumps([r.dict() for r in records], indent=4))
+        return 0
+
+    for r in records:
+        print("{} {:>6} {:<7} T:{} H:{} PIN:{:#010x}".format(
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(r.time)),
+            LEVELS[r.resolution], r.device or "avg",
+            "-" if r.temperature is None else "{:.2f}".format(r.temperature),
+            "-" if r.humidity is None else "{:.2f}".format(r.humidity),
+            r.pins))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,12 +23,14 @@
 # Standard python3 modules
 import argparse
 import binascii
+import concurrent.futures
 import json
 import os
 import re
 import select
 import struct
 import sys
+import time
 
 # Non-standard modules
 try:
@@ -38,6 +40,98 @@ except ImportError:
   sys.exit(1)
 
 
+# Names of the hid/tty device nodes, both under /sys and in /dev
+TTY_NAME = re.compile('tty.*[0-9]')
+HIDRAW_NAME = re.compile('hidraw[0-9]')
+
+# Sensor lines of the "ReadTemp" reply of serial devices
+SERIAL_INNER = re.compile(r'Temp-Inner:([0-9.]*).*, ?([0-9.]*)')
+SERIAL_OUTER = re.compile(r'Temp-Outer:([0-9.]*)')
+
+
+def device_id(info):
+  '''Return the "bus/dev" identifier (e.g. "001/004") of the USB device
+  described by 'info'.
+  '''
+  return '%03d/%03d' % (int(info['busnum']), int(info['devnum']))
+
+
+class Reading(object):
+  '''One reading of a device: firmware, temperatures in Celsius and
+  humidity in %RH as floats (None when the device has no such sensor), or
+  an error. 'info' is the device information from USBList and 'device' its
+  "bus/dev" identifier, set by Temper.read. 'dict' returns the reading as
+  the dictionary of device and sensor information Temper.read used to
+  return. 'stale' is True on a previous reading reused while the device
+  fails.
+  '''
+
+  __slots__ = ('info', 'device', 'time', 'firmware', 'hex_firmware',
+               'hex_data', 'internal_temperature', 'internal_humidity',
+               'external_temperature', 'external_humidity', 'error', 'stale')
+
+  # Reading attributes as named in the dictionary
+  FIELDS = [('firmware', 'firmware'), ('hex_firmware', 'hex_firmware'),
+            ('hex_data', 'hex_data'),
+            ('internal_temperature', 'internal temperature'),
+            ('internal_humidity', 'internal humidity'),
+            ('external_temperature', 'external temperature'),
+            ('external_humidity', 'external humidity'),
+            ('error', 'error'), ('stale', 'stale')]
+
+  def __init__(self, firmware=None, error=None):
+    self.info = None
+    self.device = None
+    self.time = time.time()
+    self.firmware = firmware
+    self.hex_firmware = None
+    self.hex_data = None
+    self.internal_temperature = None
+    self.internal_humidity = None
+    self.external_temperature = None
+    self.external_humidity = None
+    self.error = error
+    self.stale = None
+
+  def copy(self):
+    '''Return a copy of the reading.'''
+    reading = Reading()
+    for attribute in self.__slots__:
+      setattr(reading, attribute, getattr(self, attribute))
+    return reading
+
+  @classmethod
+  def from_dict(cls, info):
+    '''Return a Reading from a dictionary as returned by 'dict'.'''
+    reading = cls()
+    info = dict(info)
+    for attribute, key in cls.FIELDS:
+      setattr(reading, attribute, info.pop(key, None))
+    reading.time = info.pop('time', reading.time)
+    return reading.attach(info)
+
+  def has_value(self):
+    '''Return True if the reading holds any temperature or humidity.'''
+    return (self.internal_temperature is not None or
+            self.internal_humidity is not None or
+            self.external_temperature is not None or
+            self.external_humidity is not None)
+
+  def attach(self, info):
+    '''Set the device information of the reading and return it.'''
+    self.info = info
+    self.device = device_id(info)
+    return self
+
+  def dict(self):
+    info = dict(self.info or {})
+    for attribute, key in self.FIELDS:
+      value = getattr(self, attribute)
+      if value is not None:
+        info[key] = value
+    return info
+
+
 class USBList(object):
   '''Get a list of all of the USB devices on a system, along with their
   associated hidraw or serial (tty) devices.
@@ -45,6 +139,9 @@ class USBList(object):
 
   SYSPATH = '/sys/bus/usb/devices'
 
+  def __init__(self, syspath=None):
+    self.syspath = syspath or self.SYSPATH
+
   def _readfile(self, path):
     '''Read data from 'path' and return it as a string. Return the empty string
     if the file does not exist, cannot be read, or has an error.
@@ -63,12 +160,22 @@ class USBList(object):
     for entry in os.scandir(dirname):
         if entry.is_dir() and not entry.is_symlink():
           devices |= self._find_devices(os.path.join(dirname, entry.name))
-        if re.search('tty.*[0-9]', entry.name):
+        if TTY_NAME.search(entry.name):
           devices.add(entry.name)
-        if re.search('hidraw[0-9]', entry.name):
+        if HIDRAW_NAME.search(entry.name):
           devices.add(entry.name)
     return devices
 
+  def _get_usb_id(self, dirname):
+    '''Return the (vendorid, productid) tuple of the USB device in 'dirname',
+    or None if the directory is not for a USB device.
+    '''
+    vendorid = self._readfile(os.path.join(dirname, 'idVendor'))
+    if vendorid == '':
+      return None
+    productid = self._readfile(os.path.join(dirname, 'idProduct'))
+    return int(vendorid, 16), int(productid, 16)
+
   def _get_usb_device(self, dirname):
     '''Examine the files in 'dirname', looking for files with well-known
     names expected to be in the /sys hierarchy under Linux for USB devices.
@@ -76,17 +183,18 @@ class USBList(object):
     (i.e., because the directory is not for a USB device) return None.
     '''
     info = dict()
-    vendorid = self._readfile(os.path.join(dirname, 'idVendor'))
-    if vendorid == '':
+    usb_id = self._get_usb_id(dirname)
+    if usb_id is None:
       return None
-    info['vendorid'] = int(vendorid, 16)
-    productid = self._readfile(os.path.join(dirname, 'idProduct'))
-    info['productid'] = int(productid, 16)
+    info['vendorid'], info['productid'] = usb_id
     info['manufacturer'] = self._readfile(os.path.join(dirname,
                                                        'manufacturer'))
     info['product'] = self._readfile(os.path.join(dirname, 'product'))
     info['busnum'] = int(self._readfile(os.path.join(dirname, 'busnum')))
     info['devnum'] = int(self._readfile(os.path.join(dirname, 'devnum')))
+    # Physical port (e.g. "1-1.2") and serial number, stable across re-plugs
+    info['port'] = os.path.basename(dirname)
+    info['serial'] = self._readfile(os.path.join(dirname, 'serial'))
     info['devices'] = sorted(self._find_devices(dirname))
     return info
 
@@ -95,22 +203,165 @@ class USBList(object):
     USB devices on a system. Return these as a dictionary indexed by the path.
     '''
     info = dict()
-    for entry in os.scandir(Temper.SYSPATH):
+    for entry in os.scandir(self.syspath):
         if entry.is_dir():
-          path = os.path.join(Temper.SYSPATH, entry.name)
+          path = os.path.join(self.syspath, entry.name)
           device = self._get_usb_device(path)
           if device is not None:
             info[path] = device
     return info
 
+
+class USBIndex(object):
+  '''Keep an index of the known USB devices up to date without rescanning
+  the whole /sys hierarchy on every read.
+
+  'refresh' compares a cheap generation key (the entries of /sys/bus/usb/
+  devices with their device numbers and the hidraw/tty nodes in /dev) with
+  the one seen last time. Only when it changes are the new entries
+  identified, removed entries dropped, and the known devices examined again,
+  so a re-plugged or re-numbered device is picked up on the next read, even
+  a different device plugged into the same port between two reads. Only devices for which 'is_known' returns
+  True are scanned for their hid/tty devices.
+  '''
+
+  def __init__(self, is_known, syspath=None, devpath='/dev'):
+    self.usblist = USBList(syspath)
+    self.syspath = self.usblist.syspath
+    self.devpath = devpath
+    self.is_known = is_known
+    # Sorted by bus and device number, rebuilt only when something changed
+    self.known = []
+    self._ids = dict()
+    self._devices = dict()
+    self._generation = None
+
+  def _get_generation(self):
+    try:
+      # A device plugged in the place of another keeps the entry name, but
+      # always gets a new device number. Interfaces ("1-1:1.0") are skipped.
+      entries = frozenset(
+        (name, self.usblist._readfile(os.path.join(self.syspath, name,
+                                                   'devnum')))
+        for name in os.listdir(self.syspath) if ':' not in name)
+    except OSError:
+      entries = frozenset()
+    try:
+      nodes = frozenset(name for name in os.listdir(self.devpath)
+                        if HIDRAW_NAME.match(name) or TTY_NAME.match(name))
+    except OSError:
+      nodes = frozenset()
+    return entries, nodes
+
+  def invalidate(self):
+    '''Forget everything, the next refresh rescans all devices.'''
+    self._ids.clear()
+    self._devices.clear()
+    self._generation = None
+
+  def refresh(self):
+    '''Bring the index up to date. Return True if the known devices may
+    have changed.
+    '''
+    generation = self._get_generation()
+    if generation == self._generation:
+      return False
+
+    # The ids are cached per (entry name, device number)
+    entries = generation[0]
+    for key in list(self._ids):
+      if key not in entries:
+        del self._ids[key]
+
+    for key in entries:
+      if key not in self._ids:
+        self._ids[key] = self.usblist._get_usb_id(
+          os.path.join(self.syspath, key[0]))
+
+    self._devices.clear()
+    for (name, _), usb_id in self._ids.items():
+      if usb_id is None or not self.is_known(*usb_id):
+        continue
+      info = self.usblist._get_usb_device(os.path.join(self.syspath, name))
+      if info is not None:
+        self._devices[name] = info
+
+    self.known = sorted(self._devices.values(),
+                        key=lambda x: x['busnum'] * 1000 + x['devnum'])
+    self._generation = generation
+    return True
+
+
+class SerialReply(object):
+  '''Incrementally collect the text reply of a CH340 based (serial) TEMPer
+  device. The reply is complete once 'lines' non-empty lines have arrived, or
+  as soon as the "Temp-Outer" line, the last line of a "ReadTemp" reply, is
+  seen.
+  '''
+
+  def __init__(self, lines=1):
+    self.expected = lines
+    self.lines = []
+    self.complete = False
+    self._partial = b''
+
+  def feed(self, data):
+    '''Add the received 'data' to the reply. Return True once the reply is
+    complete.
+    '''
+    self._partial += data
+    while b'\n' in self._partial:
+      line, self._partial = self._partial.split(b'\n', 1)
+      line = str(line, 'latin-1').strip()
+      if line == '':
+        continue
+      self.lines.append(line)
+      if len(self.lines) >= self.expected or line.startswith('Temp-Outer'):
+        self.complete = True
+    return self.complete
+
+  def text(self):
+    '''Return the reply received so far with the line breaks removed.'''
+    return ''.join(self.lines + [str(self._partial, 'latin-1').strip()])
+
+
 class USBRead(object):
   '''Read temperature and/or humidity information from a specified USB device.
+
+  A hidraw or serial device is kept open between calls to 'read', and its
+  firmware identifier is only requested the first time, so a steady-state read
+  is a single command/response exchange. The device is reopened (and the
+  firmware probed again) only after an error. Call 'close' to release the
+  device.
+
+  Replies are read as frames of a known length: a read returns as soon as the
+  whole frame has arrived, and never takes longer than 'timeout' seconds.
   '''
-  def __init__(self, device, verbose=False):
+
+  FIRMWARE_COMMAND = struct.pack('8B', 0x01, 0x86, 0xff, 0x01, 0, 0, 0, 0)
+  DATA_COMMAND = struct.pack('8B', 0x01, 0x80, 0x33, 0x01, 0, 0, 0, 0)
+
+  # The hidraw devices answer in 8 byte reports. The firmware identifier is
+  # always two reports long, the data reply length depends on the firmware.
+  REPORT_SIZE = 8
+  FIRMWARE_LENGTH = 16
+  # Seconds to wait for the next report of a data reply once a whole report
+  # has arrived. Some TEMPerX only send the first 8 bytes (no external
+  # sensor), their reply is complete when no second report follows.
+  REPORT_GAP = 0.05
+
+  def __init__(self, device, verbose=False, timeout=1.0, devpath='/dev'):
     self.device = device
+    self.devpath = devpath
     self.verbose = verbose
-
-  def _parse_bytes(self, name, offset, divisor, bytes, info):
+    self.timeout = timeout
+    self._fd = None
+    self._serial = None
+    self._firmware = None
+    self._decoder = None
+    self._data_length = self.REPORT_SIZE
+
+  def _parse_bytes(self, name, offset, divisor, bytes, reading):
     '''Data is returned from several devices in a similar format. In the first
     8 bytes, the internal sensors are returned in bytes 2 and 3 (temperature)
     and in bytes 4 and 5 (humidity). In the second 8 bytes, external sensor
@@ -119,8 +370,8 @@ class USBRead(object):
     The caller is also expected to detect the firmware version and provide the
     appropriate divisor, which is usually 100 or 256.
 
-    There is no return value. Instead 'info[name]' is update directly, if a
-    value is found.
+    There is no return value. Instead the 'name' attribute of the Reading
+    'reading' is updated directly, if a value is found.
     '''
     try:
       if bytes[offset] == 0x4e and bytes[offset+1] == 0x20:
@@ -128,140 +379,334 @@ class USBRead(object):
     except:
       return
     try:
-      info[name] = struct.unpack_from('>h', bytes, offset)[0] / divisor
+      setattr(reading, name, struct.unpack_from('>h', bytes, offset)[0] / divisor)
     except:
       return
 
-  def _read_hidraw(self, device):
-    '''Using the Linux hidraw device, send the special commands and receive the
-    raw data. Then call '_parse_bytes' based on the firmware version to provide
-    temperature and humidity information.
+  def _decode_temper_f14(self, bytes, reading):
+    self._parse_bytes('internal_temperature', 2, 256.0, bytes, reading)
 
-    A dictionary of temperature and humidity info is returned.
-    '''
-    path = os.path.join('/dev', device)
-    fd = os.open(path, os.O_RDWR)
+  def _decode_temper_gold(self, bytes, reading):
+    self._parse_bytes('internal_temperature', 2, 100.0, bytes, reading)
 
-    # Get firmware identifier
-    os.write(fd, struct.pack('8B', 0x01, 0x86, 0xff, 0x01, 0, 0, 0, 0))
-    firmware = b''
+  def _decode_temper_x(self, bytes, reading):
+    self._parse_bytes('internal_temperature', 2, 100.0, bytes, reading)
+    self._parse_bytes('internal_humidity', 4, 100.0, bytes, reading)
+    self._parse_bytes('external_temperature', 10, 100.0, bytes, reading)
+    self._parse_bytes('external_humidity', 12, 100.0, bytes, reading)
+
+  def _find_decoder(self, firmware):
+    '''Return a tuple of the short firmware name, the method used to decode
+    the data reply for 'firmware' and the length of that reply. The decoder is
+    None if the firmware is not known.
+    '''
+    if firmware[:10] == 'TEMPerF1.4':
+      return firmware[:10], self._decode_temper_f14, 8
+    if firmware[:15] == 'TEMPerGold_V3.1':
+      return firmware[:15], self._decode_temper_gold, 8
+    if firmware[:12] in [ 'TEMPerX_V3.1', 'TEMPerX_V3.3' ]:
+      return firmware[:12], self._decode_temper_x, 16
+    return firmware, None, self.REPORT_SIZE
+
+  def _drain(self, fd):
+    '''Discard any reports left over from an earlier exchange that ran past
+    its deadline, so they are not mistaken for the next reply.
+    '''
     while True:
-      r, _, _ = select.select([fd], [], [], 0.1)
+      r, _, _ = select.select([fd], [], [], 0)
+      if fd not in r:
+        return
+      if not os.read(fd, self.REPORT_SIZE):
+        return
+
+  def _read_frame(self, fd, length, deadline, gap=None):
+    '''Read reports from the open hidraw device until 'length' bytes have
+    arrived or the 'deadline' (a time.monotonic() value) has passed. With
+    'gap', the frame also ends when no report follows a whole one within
+    'gap' seconds. Whatever has been received is returned, which may be
+    short or empty on timeout.
+    '''
+    bytes = b''
+    while len(bytes) < length:
+      timeout = deadline - time.monotonic()
+      if timeout <= 0:
+        break
+      if gap is not None and len(bytes) >= self.REPORT_SIZE:
+        timeout = min(timeout, gap)
+      r, _, _ = select.select([fd], [], [], timeout)
       if fd not in r:
         break
-      data = os.read(fd, 8)
-      firmware += data
+      data = os.read(fd, self.REPORT_SIZE)
+      if not data:
+        break
+      bytes += data
+    return bytes
 
+  def _exchange(self, fd, command, length, gap=None):
+    '''Send 'command' to the open hidraw device and read a reply frame of
+    'length' bytes, waiting at most 'timeout' seconds.
+    '''
+    deadline = time.monotonic() + self.timeout
+    self._drain(fd)
+    os.write(fd, command)
+    return self._read_frame(fd, length, deadline, gap)
+
+  def _open_hidraw(self, device):
+    '''Open the hidraw device, if it is not open yet, and identify its
+    firmware. The firmware and the matching decoder are kept until the device
+    is closed.
+
+    Return False if the firmware identifier cannot be read.
+    '''
+    if self._fd is None:
+      path = os.path.join(self.devpath, device)
+      self._fd = os.open(path, os.O_RDWR)
+
+    firmware = self._exchange(self._fd, self.FIRMWARE_COMMAND,
+                              self.FIRMWARE_LENGTH)
+    return self._set_firmware(firmware)
+
+  def _set_firmware(self, firmware):
+    '''Remember the firmware identifier read from the device and pick the
+    decoder for it. An empty identifier closes the device and returns False.
+    '''
     if firmware == b'':
-      os.close(fd)
-      return { 'error' : 'Cannot read firmware identifier from device' }
+      self.close()
+      return False
     if self.verbose:
       print('Firmware value: %s' % binascii.b2a_hex(firmware))
 
-    # Get temperature/humidity
-    os.write(fd, struct.pack('8B', 0x01, 0x80, 0x33, 0x01, 0, 0, 0, 0))
-    bytes = b''
-    while True:
-      r, _, _ = select.select([fd], [], [], 0.1)
-      if fd not in r:
-        break
-      data = os.read(fd, 8)
-      bytes += data
+    self._firmware = firmware
+    _, self._decoder, self._data_length = self._find_decoder(
+      str(firmware, 'latin-1').strip())
+    return True
+
+  def close(self):
+    '''Close the device, if open. The next read will reopen it and identify
+    the firmware again.
+    '''
+    if self._fd is not None:
+      try:
+        os.close(self._fd)
+      except:
+        pass
+    if self._serial is not None:
+      try:
+        self._serial.close()
+      except:
+        pass
+    self._fd = None
+    self._serial = None
+    self._firmware = None
+    self._decoder = None
+    self._data_length = self.REPORT_SIZE
+
+  def _read_hidraw(self, device):
+    '''Using the Linux hidraw device, send the special commands and receive the
+    raw data. Then call '_parse_bytes' based on the firmware version to provide
+    temperature and humidity information.
+
+    A Reading of temperature and humidity info is returned.
+    '''
+    try:
+      if self._firmware is None and not self._open_hidraw(device):
+        return Reading(error='Cannot read firmware identifier from device')
+
+      # Get temperature/humidity
+      bytes = self._exchange(self._fd, self.DATA_COMMAND, self._data_length,
+                             self.REPORT_GAP)
+    except OSError as e:
+      self.close()
+      return Reading(error='Cannot read from device: %s' % e)
+
+    return self._decode_hidraw(bytes)
+
+  def _decode_hidraw(self, bytes):
+    '''Decode the data reply 'bytes' using the firmware identified when the
+    device was opened, and return a Reading of temperature and humidity
+    info.
+    '''
+    firmware = self._firmware
+    decoder = self._decoder
 
-    os.close(fd)
     if self.verbose:
       print('Data value: %s' % binascii.hexlify(bytes))
 
-    info = dict()
-    info['firmware'] = str(firmware, 'latin-1').strip()
-    info['hex_firmware'] = str(binascii.b2a_hex(firmware), 'latin-1')
-    info['hex_data'] = str(binascii.b2a_hex(bytes), 'latin-1')
-
-    if info['firmware'][:10] == 'TEMPerF1.4':
-      info['firmware'] = info['firmware'][:10]
-      self._parse_bytes('internal temperature', 2, 256.0, bytes, info)
-      return info
-
-    if info['firmware'][:15] == 'TEMPerGold_V3.1':
-      info['firmware'] = info['firmware'][:15]
-      self._parse_bytes('internal temperature', 2, 100.0, bytes, info)
-      return info
-
-    if info['firmware'][:12] in [ 'TEMPerX_V3.1', 'TEMPerX_V3.3' ]:
-      info['firmware'] = info['firmware'][:12]
-      self._parse_bytes('internal temperature', 2, 100.0, bytes, info)
-      self._parse_bytes('internal humidity', 4, 100.0, bytes, info)
-      self._parse_bytes('external temperature', 10, 100.0, bytes, info)
-      self._parse_bytes('external humidity', 12, 100.0, bytes, info)
-      return info
-
-    info['error'] = 'Unknown firmware %s: %s' % (info['firmware'],
+    reading = Reading(str(firmware, 'latin-1').strip())
+    reading.hex_firmware = str(binascii.b2a_hex(firmware), 'latin-1')
+    reading.hex_data = str(binascii.b2a_hex(bytes), 'latin-1')
+
+    if bytes == b'':
+      # The device stopped answering, start over on the next read.
+      self.close()
+      reading.firmware, _, _ = self._find_decoder(reading.firmware)
+      reading.error = 'No data reply from device'
+      return reading
+
+    if len(bytes) < self.REPORT_SIZE:
+      # A reply cut short by the deadline fails this read only, the next one
+      # still expects the full length for the firmware. Whole reports are
+      # decoded, a missing second report leaves the external sensor unset.
+      reading.firmware, _, _ = self._find_decoder(reading.firmware)
+      reading.error = 'Short data reply, %d of %d bytes' % (len(bytes),
+                                                             self._data_length)
+      return reading
+
+    if decoder is not None:
+      reading.firmware, _, _ = self._find_decoder(reading.firmware)
+      decoder(bytes, reading)
+      return reading
+
+    reading.error = 'Unknown firmware %s: %s' % (reading.firmware,
                                                  binascii.hexlify(bytes))
-    return info
-
-  def _read_serial(self, device):
-    '''Using the Linux serial device, send the special commands and receive the
-    text data, which is parsed directly in this method.
+    return reading
 
-    A dictionary of device info (like that returned by USBList) combined with
-    temperature and humidity info is returned.
+  def _open_serial(self, device, timeout=1):
+    '''Open the serial device with the settings used by the CH340 based
+    TEMPer devices and return the serial.Serial object.
     '''
-
-    path = os.path.join('/dev', device)
+    path = os.path.join(self.devpath, device)
     s = serial.Serial(path, 9600)
     s.bytesize = serial.EIGHTBITS
     s.parity = serial.PARITY_NONE
     s.stopbits = serial.STOPBITS_ONE
-    s.timeout = 1
+    s.timeout = timeout
     s.xonoff = False
     s.rtscts = False
     s.dsrdtr = False
     s.writeTimeout = 0
+    return s
 
-    # Send the "Version" command and save the reply.
-    s.write(b'Version')
-    firmware = str(s.readline(), 'latin-1').strip()
+  def _serial_exchange(self, command, lines):
+    '''Send 'command' to the open serial device and feed the reply to a
+    SerialReply as it arrives, until it is complete or 'timeout' seconds have
+    passed.
+    '''
+    deadline = time.monotonic() + self.timeout
+    fd = self._serial.fileno()
+    reply = SerialReply(lines)
+    self._serial.reset_input_buffer()
+    self._serial.write(command)
+    while not reply.complete:
+      timeout = deadline - time.monotonic()
+      if timeout <= 0:
+        break
+      r, _, _ = select.select([fd], [], [], timeout)
+      if fd not in r:
+        break
+      data = os.read(fd, 64)
+      if not data:
+        break
+      reply.feed(data)
+    return reply
 
-    # Send the "ReadTemp" command and save the reply.
-    s.write(b'ReadTemp')
-    reply = str(s.readline(), 'latin-1').strip()
-    reply += str(s.readline(), 'latin-1').strip()
-    s.close()
+  def _open_serial_session(self, device):
+    '''Open the serial device and ask for its firmware with the "Version"
+    command. The port and the firmware are kept until the device is closed.
 
-    info = dict()
-    info['firmware'] = firmware
-    m = re.search(r'Temp-Inner:([0-9.]*).*, ?([0-9.]*)', reply)
+    Return False if the firmware version cannot be read.
+    '''
+    self._serial = self._open_serial(device, timeout=0)
+    return self._set_serial_firmware(self._serial_exchange(b'Version', 1))
+
+  def _set_serial_firmware(self, reply):
+    '''Remember the firmware version from the SerialReply 'reply'. An
+    incomplete reply closes the port and returns False, so the next read
+    opens a new session instead of keeping a partial firmware.
+    '''
+    if not reply.complete:
+      self.close()
+      return False
+    self._firmware = bytes(reply.text(), 'latin-1')
+    return True
+
+  def _read_serial(self, device):
+    '''Using the Linux serial device, send the special commands and receive the
+    text data, which is parsed by '_decode_serial'.
+
+    The port stays open between reads. If the port fails, it is reopened and
+    the read tried once more; if the reply does not complete in time, the port
+    is reopened on the next read.
+
+    A Reading of temperature and humidity info is returned.
+    '''
+    error = None
+    for _ in range(2):
+      try:
+        if self._firmware is None and not self._open_serial_session(device):
+          return Reading(error='Cannot read firmware version from device')
+
+        # Send the "ReadTemp" command and save the reply.
+        reply = self._serial_exchange(b'ReadTemp', 2)
+      except OSError as e:
+        self.close()
+        error = e
+        continue
+
+      firmware = str(self._firmware, 'latin-1')
+      if not reply.complete:
+        self.close()
+      return self._decode_serial(firmware, reply.text())
+
+    return Reading(error='Cannot read from device: %s' % error)
+
+  def _decode_serial(self, firmware, reply):
+    '''Parse the text 'reply' to the "ReadTemp" command and return a
+    Reading of temperature and humidity info.
+    '''
+    reading = Reading(firmware)
+    m = SERIAL_INNER.search(reply)
     if m is not None:
-      info['internal temperature'] = float(m.group(1))
-      info['internal humidity'] = float(m.group(2))
-    m = re.search(r'Temp-Outer:([0-9.]*)', reply)
+      reading.internal_temperature = float(m.group(1))
+      reading.internal_humidity = float(m.group(2))
+    m = SERIAL_OUTER.search(reply)
     if m is not None:
       try:
-        info['external temperature'] = float(m.group(1))
+        reading.external_temperature = float(m.group(1))
       except:
         pass
-    return info
+    return reading
 
   def read(self):
     '''Read the firmware version, temperature, and humidity from the device and
-    return a dictionary containing these data.
+    return a Reading containing these data.
     '''
     # Use the last device found
     if self.device.startswith('hidraw'):
       return self._read_hidraw(self.device)
     if self.device.startswith('tty'):
       return self._read_serial(self.device)
-    return {'error': 'No usable hid/tty devices available'}
+    return Reading(error='No usable hid/tty devices available')
 
 class Temper(object):
   SYSPATH = '/sys/bus/usb/devices'
 
-  def __init__(self, verbose=False):
-    usblist = USBList()
-    self.usb_devices = usblist.get_usb_devices()
+  # Upper bound on worker threads used by read(parallel=True)
+  MAX_WORKERS = 32
+
+  def __init__(self, verbose=False, timeout=1.0, device_timeout=None,
+               syspath=None, devpath='/dev'):
+    self.syspath = syspath or self.SYSPATH
+    self.devpath = devpath
+    self.index = USBIndex(self._is_known_id, self.syspath, devpath)
+    self._usb_devices = None
     self.forced_vendor_id = None
     self.forced_product_id = None
     self.verbose = verbose
+    self.timeout = timeout
+    self.device_timeout = device_timeout
+    self._readers = dict()
+    self._pending = dict()
+    self._pool = None
+
+  @property
+  def usb_devices(self):
+    '''All of the USB devices on the system, as returned by
+    USBList.get_usb_devices. The full scan is only done on first use.
+    '''
+    if self._usb_devices is None:
+      self._usb_devices = USBList(self.syspath).get_usb_devices()
+    return self._usb_devices
 
   def _is_known_id(self, vendorid, productid):
     '''Returns True if the vendorid and product id are valid.
@@ -303,26 +748,118 @@ class Temper(object):
         info.get('product', '???'),
         list(info['devices']) if len(info['devices']) > 0 else ''))
 
-  def read(self, verbose=False):
+  def read(self, verbose=False, parallel=False):
     '''Read all of the known devices on the system and return a list of
-    dictionaries which contain the device information, firmware information,
+    Readings which contain the device information, firmware information,
     and environmental information obtained. If there is an error, then the
-    'error' field in the dictionary will contain a string explaining the
+    'error' attribute of the Reading will contain a string explaining the
     error.
+
+    If 'parallel' is True, all devices are queried at the same time and a
+    device that does not answer within 'device_timeout' seconds is reported
+    with an error instead of holding back the others.
     '''
-    results = []
-    for _, info in sorted(self.usb_devices.items(),
-                          key=lambda x: x[1]['busnum'] * 1000 + \
-                          x[1]['devnum']):
-      if not self._is_known_id(info['vendorid'], info['productid']):
-        continue
+    devices = self._known_devices()
+
+    if parallel:
+      readings = self._read_parallel(devices, verbose)
+    else:
+      readings = [self._read_device(info, verbose) for info in devices]
+    return [reading.attach(info) for info, reading in zip(devices, readings)]
+
+  def _known_devices(self):
+    '''Return the information of every known device, sorted by bus and
+    device number. The device index is refreshed first, and the sessions of
+    devices that went away are closed, by the worker thread once its read
+    returns when one is still running.
+    '''
+    if self.index.refresh():
+      current = set(info['devices'][-1] for info in self.index.known
+                    if len(info['devices']) > 0)
+      for device in list(self._readers):
+        if device not in current:
+          usbread = self._readers.pop(device)
+          pending = self._pending.pop(device, None)
+          if pending is None:
+            usbread.close()
+          else:
+            # Runs at once if the read is already done
+            pending.add_done_callback(lambda _, usbread=usbread: usbread.close())
+    return self.index.known
+
+  def _read_device(self, info, verbose=False):
+    '''Read the last hid/tty device of the USB device described by 'info'.
+    '''
+    if len(info['devices']) == 0:
+      return Reading(error='no hid/tty devices available')
+    return self._get_reader(info['devices'][-1], verbose).read()
+
+  def _read_parallel(self, devices, verbose=False):
+    '''Read every device in 'devices' on its own worker thread and return
+    the readings in the same order. A read still running after
+    'device_timeout' seconds is left to finish in the background; the device
+    is reported with an error until it has.
+    '''
+    if self._pool is None:
+      self._pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=self.MAX_WORKERS)
+
+    readings = [None] * len(devices)
+    futures = dict()
+    for i, info in enumerate(devices):
       if len(info['devices']) == 0:
-        info['error'] = 'no hid/tty devices available'
-        results.append(info)
+        readings[i] = self._read_device(info, verbose)
+        continue
+      device = info['devices'][-1]
+      pending = self._pending.get(device)
+      if pending is not None and not pending.done():
+        readings[i] = Reading(error='Previous read still running')
         continue
-      usbread = USBRead(info['devices'][-1], verbose)
-      results.append({ **info, **usbread.read() })
-    return results
+      # Create the session here so the worker threads never touch _readers.
+      self._get_reader(device, verbose)
+      future = self._pool.submit(self._read_device, info, verbose)
+      self._pending[device] = future
+      futures[i] = future
+
+    concurrent.futures.wait(futures.values(), timeout=self.device_timeout)
+
+    for i, future in futures.items():
+      if not future.done():
+        readings[i] = Reading(error='Timed out reading from device')
+        continue
+      try:
+        readings[i] = future.result()
+      except Exception as e:
+        readings[i] = Reading(error='Cannot read from device: %s' % e)
+    return readings
+
+  def _get_reader(self, device, verbose=False):
+    '''Return the open USBRead session for 'device', creating it on first use.
+    '''
+    usbread = self._readers.get(device)
+    if usbread is None:
+      usbread = self._new_reader(device, verbose)
+      self._readers[device] = usbread
+    usbread.verbose = verbose
+    return usbread
+
+  def _new_reader(self, device, verbose=False):
+    '''Create the USBRead session used for 'device'.
+    '''
+    return USBRead(device, verbose, self.timeout, self.devpath)
+
+  def close(self):
+    '''Close every device session opened by 'read'.
+    '''
+    if self._pool is not None:
+      # Reads are bounded by 'timeout', wait for them before closing their
+      # sessions.
+      self._pool.shutdown(wait=True)
+      self._pool = None
+    self._pending.clear()
+    for usbread in self._readers.values():
+      usbread.close()
+    self._readers.clear()
 
   def _add_temperature(self, name, info):
     '''Helper method to add the temperature to a string in both Celsius and
@@ -348,11 +885,13 @@ class Temper(object):
     If 'use_json' is True, then JSON formatting will be used.
     '''
 
+    readings = results
+    results = [r.dict() for r in results]
     if use_json:
       print(json.dumps(results, indent=4))
       return
 
-    for info in results:
+    for reading, info in zip(readings, results):
       s = 'Bus %03d Dev %03d %04x:%04x %s' % (info['busnum'],
                                               info['devnum'],
                                               info['vendorid'],
@@ -365,6 +904,10 @@ class Temper(object):
         s += ' ' + self._add_humidity('internal humidity', info)
         s += ' ' + self._add_temperature('external temperature', info)
         s += ' ' + self._add_humidity('external humidity', info)
+      if info.get('stale'):
+        # Reused by rpioalert while the device fails
+        s += ' Stale: read at %s' % time.strftime('%Y-%m-%d %H:%M:%S',
+                                                   time.localtime(reading.time))
       print(s)
 
   def main(self):
@@ -382,9 +925,33 @@ class Temper(object):
                         metavar=('VENDOR_ID:PRODUCT_ID'))
     parser.add_argument('--verbose', action='store_true',
                         help='Output binary data from thermometer')
+    parser.add_argument('--from-daemon', type=str, nargs='?', const='rpioalert',
+                        help='Print the readings published by rpioalert --shm '
+                        'instead of opening the devices',
+                        metavar='NAME')
     args = parser.parse_args()
     self.verbose = args.verbose
 
+    if args.from_daemon:
+      try:
+        from .shm import ShmError, read
+      except ImportError:
+        from shm import ShmError, read
+      try:
+        status = read(args.from_daemon)
+      except ShmError as e:
+        print(e)
+        return 1
+      if not args.json:
+        published = 'never'
+        if status['time']:
+          published = time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(status['time']))
+        print('Published at %s' % published)
+      self.print([Reading.from_dict(info) for info in status['devices']],
+                 args.json)
+      return 0
+
     if args.list:
       self.list(args.json)
       return 0
@@ -402,9 +969,12 @@ class Temper(object):
         return 1
       self.forced_vendor_id = vendor_id;
       self.forced_product_id = product_id;
+      self.index.invalidate()
 
-    # By default, output the temperature and humidity for all known sensors.
-    results = self.read(args.verbose)
+    # By default, output the temperature and humidity for all known sensors,
+    # read at the same time.
+    results = self.read(args.verbose, parallel=True)
+    self.close()
     self.print(results, args.json)
     return 0
 
@@ -0,0 +1,130 @@
+import json
+
+from .condition import Condition, ConditionError
+
+
+class Zone:
+    """
+    A group of sensors driving its own pins with its own conditions
+
+    sensors selects the devices by "bus/dev" id (e.g. "001/004"), USB port
+    (e.g. "1-1.2") or serial number, an empty list selects every device.
+    The zone average is taken over the selected devices only.
+    """
+
+    def __init__(self, name, pins, off_condition=Condition(), on_condition=Condition(), off_first=False, sensors=[]):
+        self.name = name
+        self.pins = pins
+        self.off_condition = off_condition
+        self.on_condition = on_condition
+        self.off_first = off_first
+        self.sensors = list(sensors)
+        self.temperature = None
+        self.humidity = None
+        self.devices = []
+        self._keys = frozenset(self.sensors)
+
+    def matches(self, reading):
+        if not self._keys:
+            return True
+        if reading.device in self._keys:
+            return True
+        info = reading.info or {}
+        return info.get("port") in self._keys or (
+            bool(info.get("serial")) and info.get("serial") in self._keys)
+
+    def update(self, readings):
+        """
+        Average the internal sensors of the matching readings
+        return False when no matching device has both values
+        """
+        temps = []
+        humis = []
+        devices = []
+        for r in readings:
+            if not self.matches(r):
+                continue
+            devices.append(r.device)
+            if r.internal_temperature is not None:
+                temps.append(r.internal_temperature)
+            if r.internal_humidity is not None:
+                humis.append(r.internal_humidity)
+
+        self.devices = devices
+        if not temps or not humis:
+            self.temperature = None
+            self.humidity = None
+            return False
+
+        self.temperature = sum(temps) / len(temps)
+        self.humidity = sum(humis) / len(humis)
+        return True
+
+    def thresholds(self):
+        return self.off_condition.thresholds() + self.on_condition.thresholds()
+
+    def dict(self):
+        return {
+            "name": self.name,
+            "sensors": self.sensors,
+            "devices": self.devices,
+            "status": {"temperature": self.temperature, "humidity": self.humidity},
+            "condition": {
+                "off": list(self.off_condition.conditions),
+                "on": list(self.on_condition.conditions),
+                "off_first": self.off_first
+            },
+            "led": self.pins.state()
+        }
+
+    def __str__(self):
+        return "Zone {} T:{}, H:{}, {}".format(
+            self.name, self.temperature, self.humidity, self.pins)
+
+
+def parse_zone(text, condition=Condition):
+    """
+    Parse and check a --zone definition, JSON text or already decoded,
+    return its settings as a dict with name, sensors, pins, on and off
+    conditions compiled by condition and off_first
+
+    e.g. {"name": "rack1", "sensors": ["001/004", "1-1.2"], "pins": [17],
+          "on": ["temp:gte:30"], "off": ["temp:lt:28"], "off_first": false}
+    """
+    if isinstance(text, dict):
+        config = text
+    else:
+        try:
+            config = json.loads(text)
+        except ValueError as e:
+            raise ConditionError("Invalid zone '{}': {}".format(text, e))
+
+    if not isinstance(config, dict) or not config.get("name"):
+        raise ConditionError("Invalid zone '{}', a zone needs a name".format(text))
+
+    unknown = set(config) - {"name", "sensors", "pins", "on", "off", "off_first"}
+    if unknown:
+        raise ConditionError("Unknown zone setting {} in zone {}".format(
+            ", ".join(sorted(unknown)), config["name"]))
+
+    def strings(key):
+        value = config.get(key, [])
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list):
+            raise ConditionError("Invalid {} in zone {}".format(key, config["name"]))
+        return [str(v) for v in value]
+
+    try:
+        pins = [int(pin) for pin in config.get("pins", [])]
+    except (TypeError, ValueError):
+        raise ConditionError("Invalid pins in zone {}".format(config["name"]))
+
+    return {
+        "name": str(config["name"]),
+        "sensors": strings("sensors"),
+        "pins": pins,
+        "on_condition": condition(strings("on")),
+        "off_condition": condition(strings("off")),
+        "off_first": bool(config.get("off_first", False))
+    }
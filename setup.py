@@ -16,6 +16,8 @@ setup(name='rpioalert',
     entry_points={
         'console_scripts': [
             'rpioalert=rpioalert.__main__:main',
+            'rpioalert-history=rpioalert.store:main',
+            'rpioalert-benchmark=rpioalert.benchmark:main',
         ]
     }
 )
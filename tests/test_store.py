@@ -0,0 +1,50 @@
+import collections
+import shutil
+import tempfile
+import unittest
+
+from rpioalert.store import HOUR, MINUTE, RAW, Record, Store
+
+
+class StoreQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # Tiny segments so minutes and hours are split across segments
+        self.store = Store(self.directory, capacity=7, keep={RAW: 1, MINUTE: 2, HOUR: 100})
+        start = 1000000000 // HOUR * HOUR
+        for i in range(400):
+            self.store.append([Record(start + i * 13, "d", 20 + i % 5, 50, 1)])
+            if self.store.pending:
+                self.store.compact()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_rollup_writes_each_bucket_once(self):
+        records = self.store.query()
+        counts = collections.Counter((r.time, r.device, r.resolution) for r in records)
+        self.assertEqual([key for key, count in counts.items() if count > 1], [])
+        self.assertEqual(set(r.resolution for r in records), {RAW, MINUTE, HOUR})
+
+    def test_query_across_the_rollup_boundary(self):
+        records = self.store.query()
+        self.assertEqual([r.time for r in records], sorted(r.time for r in records))
+        # No record of a finer level falls in a bucket of a coarser one
+        for coarse in records:
+            if coarse.resolution == RAW:
+                continue
+            end = coarse.time + coarse.resolution
+            overlap = [r for r in records
+                       if r.resolution < coarse.resolution and coarse.time <= r.time < end]
+            self.assertEqual(overlap, [])
+
+        # The same from a since inside the rolled up range
+        minute = next(r for r in records if r.resolution == MINUTE)
+        since = [r.time for r in self.store.query(since=minute.time + 1)]
+        self.assertEqual(since, sorted(since))
+        self.assertEqual(len(since), len(set(since)))
+
+
+if __name__ == "__main__":
+    unittest.main()